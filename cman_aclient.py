@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import random
+import socket
+import time
+from collections import deque
+from enum import IntEnum
+
+import cman_netstats
+import message_util
+
+JOIN_TIMEOUT = 2
+JOIN_ATTEMPTS = 3
+MAX_EVENTS = 64
+MOVE_INTERVAL = 0.01
+IDLE_TIMEOUT = 30
+
+
+class ClientRole(IntEnum):
+    WATCHER = 0
+    CMAN = 1
+    SPIRIT = 2
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client.datagram_received(data)
+
+    def error_received(self, exc):
+        self.client.error_received(exc)
+
+
+class AsyncGameClient:
+    """Headless asyncio client, many of them can share one event loop.
+
+    Usage:
+
+        client = AsyncGameClient("127.0.0.1", 1337, "cman")
+        await client.join()
+        async for message in client:
+            ...  # decoded state update, game end, error messages
+        client.quit()
+
+    Only the latest MAX_EVENTS messages are kept for a consumer that falls
+    behind, older state updates are dropped first.
+    """
+
+    def __init__(self, server_host, server_port, role, room=None, max_events=MAX_EVENTS):
+        self.server_address = (server_host, server_port)
+        self.role = ClientRole[role.upper()] if isinstance(role, str) else ClientRole(role)
+        self.room = room
+        self.can_move = False
+        self.state = None  # latest decoded state update
+        self.stats = cman_netstats.NetStats()
+
+        self.transport = None
+        self.closed = False
+        self.events = deque()
+        self.max_events = max_events
+        self.waiter = None
+        self.join_future = None
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: ClientProtocol(self), local_addr=("0.0.0.0", 0), family=socket.AF_INET
+        )
+
+    async def join(self, timeout=JOIN_TIMEOUT, attempts=JOIN_ATTEMPTS):
+        """Joins the game, following a lobby redirect if there is one.
+
+        Raises ConnectionError when the server refuses the join and
+        TimeoutError when it does not answer.
+        """
+        if self.transport is None:
+            await self.connect()
+
+        loop = asyncio.get_running_loop()
+        for _ in range(attempts):
+            self.join_future = loop.create_future()
+            self.send(message_util.create_join_message(self.role, self.room))
+            try:
+                response = await asyncio.wait_for(self.join_future, timeout)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                self.join_future = None
+
+            if response[0] == message_util.OPCODE_REDIRECT:
+                _, host, port, room = response
+                self.server_address = (host, port)
+                self.room = room
+                return await self.join(timeout, attempts)
+            if response[0] == message_util.OPCODE_ERROR:
+                self.close()
+                raise ConnectionError(response[1].decode("utf-8"))
+            return response
+        self.close()
+        raise TimeoutError("Server not responding")
+
+    def send(self, data):
+        if not self.closed:
+            self.transport.sendto(data, self.server_address)
+
+    def move(self, direction):
+        self.send(message_util.create_player_movement_message(direction))
+
+    def ping(self):
+        self.send(self.stats.create_ping(time.perf_counter()))
+
+    def quit(self):
+        self.send(message_util.create_quit_message())
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+        self.wake()
+
+    def handle_game_state(self, message):
+        self.state = message
+        self.can_move = not message[1] if self.role != ClientRole.WATCHER else False
+
+    def datagram_received(self, data):
+        try:
+            messages = message_util.decode_messages(data)
+        except Exception:
+            return
+        for message in messages:
+            self.message_received(message)
+
+    def message_received(self, message):
+        if message[0] == message_util.OPCODE_PONG:
+            self.stats.handle_pong(message, time.perf_counter())
+            return
+        if self.join_future is not None and not self.join_future.done():
+            self.join_future.set_result(message)
+            if message[0] != message_util.OPCODE_GAME_STATE_UPDATE:
+                return
+            # An accepted join is also the first state, queue it before anything that follows
+
+        if message[0] == message_util.OPCODE_GAME_STATE_UPDATE:
+            self.handle_game_state(message)
+        if len(self.events) >= self.max_events:
+            # Rather lose a state update, a newer one follows, than a game end or an error
+            stale = next(
+                (event for event in self.events if event[0] == message_util.OPCODE_GAME_STATE_UPDATE),
+                self.events[0],
+            )
+            self.events.remove(stale)
+        self.events.append(message)
+        self.wake()
+
+    def error_received(self, exc):
+        # ICMP port unreachable and the like, the server is gone
+        self.close()
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next_event(self, timeout=None):
+        """Returns the next message, or None if none arrived within timeout seconds or the client is closed."""
+        if not self.events and not self.closed:
+            loop = asyncio.get_running_loop()
+            self.waiter = loop.create_future()
+            timer = loop.call_later(timeout, self.wake) if timeout is not None else None
+            await self.waiter
+            if timer is not None:
+                timer.cancel()
+        return self.events.popleft() if self.events else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = None
+        while message is None:
+            if self.closed and not self.events:
+                raise StopAsyncIteration
+            message = await self.next_event()
+        return message
+
+
+async def play_random(client, rnd, max_moves=1000, interval=MOVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+    """Plays random moves until the game ends, returns the game end message or None.
+
+    Moves are paced to one per interval and keep going when nothing arrives,
+    a lost datagram must not leave both players waiting for each other.
+    Raises TimeoutError when nothing arrives for idle_timeout seconds, for
+    example when the opponent never managed to join.
+    """
+    await client.join()
+    moves = 0
+    last_move = 0
+    last_message = time.monotonic()
+    try:
+        while moves < max_moves and not client.closed:
+            message = await client.next_event(interval)
+            if message is None:
+                if time.monotonic() - last_message > idle_timeout:
+                    raise TimeoutError("No message from the server")
+            else:
+                last_message = time.monotonic()
+                if message[0] == message_util.OPCODE_GAME_END:
+                    return message
+                if message[0] == message_util.OPCODE_ERROR:
+                    raise ConnectionError(message[1].decode("utf-8"))
+
+            now = time.monotonic()
+            if client.can_move and now - last_move >= interval:
+                client.move(rnd.randrange(4))
+                last_move = now
+                moves += 1
+    finally:
+        client.quit()
+    return None
+
+
+async def run_matches(host, port, matches, first_room, max_moves, seed):
+    rnd = random.Random(seed)
+    sessions = []
+    for i in range(matches):
+        room = None if first_room is None else first_room + i
+        for role in (ClientRole.CMAN, ClientRole.SPIRIT):
+            client = AsyncGameClient(host, port, role, room)
+            sessions.append(play_random(client, random.Random(rnd.random()), max_moves))
+    results = await asyncio.gather(*sessions, return_exceptions=True)
+    finished = sum(1 for result in results if isinstance(result, tuple))
+    failed = sum(1 for result in results if isinstance(result, BaseException))
+    return finished, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bots parser")
+    parser.add_argument("addr", type=str, help="Server or lobby address (IP or hostname)")
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=1337,
+        help="Port number to use (default: 1337)",
+    )
+    parser.add_argument(
+        "-n",
+        "--matches",
+        type=int,
+        default=100,
+        help="Number of concurrent matches, two clients each (default: 100)",
+    )
+    parser.add_argument(
+        "-r",
+        "--room",
+        type=int,
+        default=1,
+        help="Room of the first match, the others follow (default: 1)",
+    )
+    parser.add_argument(
+        "--lobby",
+        action="store_true",
+        help="Let the lobby pick the rooms instead of --room",
+    )
+    parser.add_argument(
+        "--max-moves",
+        type=int,
+        default=100000,
+        help="Moves per client before giving up (default: 100000)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+
+    first_room = None if args.lobby else args.room
+    started = time.perf_counter()
+    finished, failed = asyncio.run(
+        run_matches(args.addr, args.port, args.matches, first_room, args.max_moves, args.seed)
+    )
+    elapsed = time.perf_counter() - started
+    print(f"{args.matches * 2} clients: {finished} saw the game end, {failed} failed, in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"Error in main: {e}")
@@ -0,0 +1,622 @@
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import random
+import select
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cman_aclient
+import cman_bitboard
+import cman_game as game
+import cman_game_map
+import cman_server
+import cman_snapshot
+import message_util
+
+MAP_PATH = "map.txt"
+SOAK_GRACE = 30  # seconds the soak waits for the last matches to end after its duration
+SOAK_WINDOWS = 3  # samples averaged at each end of a soak to compare them
+REJOIN_DELAY = 0.2  # seconds a soak lane waits for its room to restart between two matches
+RESEND_TIMEOUT = 0.2  # seconds a throughput player waits for an answer before moving again
+# Soak latencies are kept per handler, a slow join hides behind thousands of fast moves otherwise
+HANDLERS = {
+    message_util.OPCODE_JOIN_REQUEST: "join",
+    message_util.OPCODE_PLAYER_MOVEMENT: "move",
+    message_util.OPCODE_PING: "ping",
+    message_util.OPCODE_QUIT: "quit",
+}
+
+
+def traced_bytes(build, count):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = build(count)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return used / count
+
+
+def make_room_server(max_rooms):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    return cman_server.RoomServer(sock.getsockname()[1], sock, max_rooms, MAP_PATH)
+
+
+def bench_rooms(args):
+    """Memory taken by idle rooms, per Game and per full GameServer room."""
+    server = make_room_server(args.count)
+
+    def build_games(count):
+        return [game.Game(MAP_PATH) for _ in range(count)]
+
+    def build_rooms(count):
+        for room_id in range(count):
+            server.get_room(room_id, create=True)
+        return server.rooms
+
+    started = time.perf_counter()
+    per_game = traced_bytes(build_games, args.count)
+    per_room = traced_bytes(build_rooms, args.count)
+    elapsed = time.perf_counter() - started
+
+    print(f"idle rooms: {args.count}")
+    print(f"bytes per Game: {per_game:.0f}")
+    print(f"bytes per room: {per_room:.0f}")
+    print(f"elapsed: {elapsed:.2f}s")
+    server.socket_udp.close()
+
+
+def bench_snapshot(args):
+    """Snapshot and restore time of busy rooms, two players and a watcher each."""
+    server = make_room_server(args.count)
+    for room_id in range(args.count):
+        room = server.get_room(room_id, create=True)
+        base_port = 10000 + room_id * 3
+        for offset, role in enumerate(cman_server.ClientRole):
+            addr = ("127.0.0.1", base_port + offset)
+            room.clients[addr] = role
+            server.client_rooms[addr] = room_id
+            if role != cman_server.ClientRole.WATCHER:
+                room.role_assignments[role] = addr
+        room.game_active = True
+        room.game.state = game.State.PLAY
+        room.game.apply_move(game.Player.CMAN, game.Direction.RIGHT)
+
+    dump_times = []
+    load_times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        data = cman_snapshot.dump_rooms(server)
+        dump_times.append(time.perf_counter() - started)
+
+        restored = make_room_server(args.count)
+        started = time.perf_counter()
+        cman_snapshot.load_rooms(restored, data)
+        load_times.append(time.perf_counter() - started)
+        restored.socket_udp.close()
+
+    print(f"rooms: {args.count}")
+    print(f"snapshot size: {len(data)} bytes")
+    print(f"snapshot: {min(dump_times) * 1000:.2f}ms (best of {args.repeat})")
+    print(f"restore: {min(load_times) * 1000:.2f}ms (best of {args.repeat})")
+    server.socket_udp.close()
+
+
+def bench_bitboard(args):
+    """Checks BitState against Game on random games, then measures search speed."""
+    rnd = random.Random(args.seed)
+    bitmap = cman_bitboard.load_bitmap(MAP_PATH)
+
+    moves = 0
+    for _ in range(args.games):
+        reference = game.Game(MAP_PATH)
+        reference.state = game.State.START
+        state = cman_bitboard.BitState.from_game(reference, bitmap)
+        for _ in range(args.moves):
+            if reference.state == game.State.WIN:
+                break
+            player = rnd.choice(list(game.Player)[1:])
+            direction = rnd.choice(list(game.Direction))
+            applied = reference.apply_move(player, direction)
+            child = state.apply_move(player, direction)
+            assert applied == (child is not None), "move legality differs from Game"
+            if child is not None:
+                state = child
+            assert state.get_current_players_coords() == reference.get_current_players_coords()
+            assert (state.lives, state.score, state.state, state.get_winner()) == (
+                reference.lives,
+                reference.score,
+                reference.state,
+                reference.get_winner(),
+            ), "state differs from Game"
+            assert state.get_collected() == reference.get_collected()
+            moves += 1
+    print(f"matched Game.apply_move on {moves} moves over {args.games} games")
+
+    root = cman_bitboard.BitState.initial(bitmap, game.State.PLAY)
+    counter = [0]
+    started = time.perf_counter()
+    value, move = cman_bitboard.minimax(root, args.depth, counter=counter)
+    elapsed = time.perf_counter() - started
+    print(f"minimax depth {args.depth}: best {move.name if move is not None else None} ({value:.2f})")
+    print(f"expanded {counter[0]} nodes in {elapsed:.2f}s, {counter[0] / elapsed:.0f} nodes/s")
+
+
+def clear_map_caches():
+    game._maps.clear()
+    game._maps_by_digest.clear()
+    cman_game_map._specs.clear()
+    cman_game_map._layouts.clear()
+    cman_game_map._packs.clear()
+
+
+def bench_maps(args):
+    """Cold load time of a textual map against the same map in a pack, and of a cached map."""
+    pack_path = args.pack
+    cman_game_map.compile_pack([MAP_PATH], pack_path)
+
+    def best_of(load):
+        times = []
+        for _ in range(args.repeat):
+            clear_map_caches()
+            started = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    text = best_of(lambda: game.load_map(MAP_PATH))
+    packed = best_of(lambda: game.load_map(pack_path))
+    assert game.load_map(pack_path).board == tuple(cman_game_map.read_map(MAP_PATH).split("\n"))
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        game.Game(pack_path)
+    cached = (time.perf_counter() - started) / args.repeat
+
+    print(f"text map load: {text * 1e6:.0f}us (best of {args.repeat})")
+    print(f"pack map load: {packed * 1e6:.0f}us (best of {args.repeat})")
+    print(f"new Game on a loaded map: {cached * 1e6:.1f}us")
+    os.remove(pack_path)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def read_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def read_udp_queues(port):
+    """Kernel send queue, receive queue and drops of the UDP socket bound to port, None without /proc/net/udp."""
+    try:
+        with open("/proc/net/udp") as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    for line in lines:
+        fields = line.split()
+        if int(fields[1].split(":")[1], 16) == port:
+            tx_queue, rx_queue = (int(value, 16) for value in fields[4].split(":"))
+            return tx_queue, rx_queue, int(fields[12])
+    return None
+
+
+class SoakRoomServer(cman_server.RoomServer):
+    """RoomServer that times every handled datagram by opcode and samples itself from tick()."""
+
+    def __init__(self, sock, max_rooms, sample_interval, on_sample):
+        super().__init__(sock.getsockname()[1], sock, max_rooms, MAP_PATH)
+        self.latencies = {}  # {handler name: [seconds]}
+        self.sample_interval = sample_interval
+        self.next_sample = 0
+        self.on_sample = on_sample
+
+    def handle_datagram(self, data, client_addr, received=None):
+        started = time.perf_counter()
+        try:
+            super().handle_datagram(data, client_addr, received)
+        finally:
+            elapsed = time.perf_counter() - started
+            handler = HANDLERS.get(data[0], "other") if data else "other"
+            latencies = self.latencies.get(handler)
+            if latencies is None:
+                self.latencies[handler] = [elapsed]
+            else:
+                latencies.append(elapsed)
+
+    def tick(self, now):
+        super().tick(now)
+        if now >= self.next_sample:
+            self.next_sample = now + self.sample_interval
+            latencies, self.latencies = self.latencies, {}
+            self.on_sample(now, latencies)
+
+
+async def soak_lane(port, room, rnd, deadline, args, totals):
+    """Plays matches in one room until the deadline: a watcher, two random players, one of them quitting early."""
+    while time.monotonic() < deadline:
+        watcher = cman_aclient.AsyncGameClient("127.0.0.1", port, "watcher", room)
+        try:
+            await watcher.join()
+        except (ConnectionError, TimeoutError):
+            totals["errors"] += 1
+            await asyncio.sleep(REJOIN_DELAY)
+            continue
+
+        # Unless the game is won first, the quitter's quit ends it for the other player
+        quitter = rnd.choice(("cman", "spirit"))
+        players = [
+            cman_aclient.play_random(
+                cman_aclient.AsyncGameClient("127.0.0.1", port, role, room),
+                random.Random(rnd.random()),
+                rnd.randint(1, args.max_moves) if role == quitter else sys.maxsize,
+                args.move_interval,
+                args.idle_timeout,
+            )
+            for role in ("cman", "spirit")
+        ]
+        results = await asyncio.gather(*players, return_exceptions=True)
+        totals["matches"] += 1
+        if any(isinstance(result, tuple) for result in results):
+            totals["games"] += 1
+        totals["errors"] += sum(1 for result in results if isinstance(result, BaseException))
+
+        if rnd.random() < args.abandon:
+            # Gone without a quit, the way a crashed watcher leaves
+            watcher.close()
+            totals["abandoned"] += 1
+        else:
+            watcher.quit()
+        await asyncio.sleep(REJOIN_DELAY)
+
+
+async def soak_clients(port, args):
+    totals = {"matches": 0, "games": 0, "errors": 0, "abandoned": 0}
+    deadline = time.monotonic() + args.duration
+    rnd = random.Random(args.seed)
+    lanes = [
+        soak_lane(port, room, random.Random(rnd.random()), deadline, args, totals)
+        for room in range(1, args.lanes + 1)
+    ]
+    await asyncio.gather(*lanes)
+    return totals
+
+
+def run_soak_clients(port, args, conn):
+    conn.send(asyncio.run(soak_clients(port, args)))
+    conn.close()
+
+
+def bench_soak(args):
+    """Runs match lifecycles against an in-process server and fails if memory or p99 latency drift.
+
+    The clients live in a child process, so RSS, tracemalloc and handler
+    latencies only ever measure the server.
+    """
+    # Short game ends, so that a lane can cycle through many games
+    cman_server.END_GAME_REPEATS = args.end_repeats
+    cman_server.END_GAME_INTERVAL = args.end_interval
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+
+    if args.trace:
+        tracemalloc.start()
+    samples = []
+    snapshots = []
+    started = time.time()
+
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    clients = multiprocessing.Process(target=run_soak_clients, args=(port, args, child_conn), daemon=True)
+
+    def on_sample(now, latencies):
+        elapsed = now - started
+        queues = read_udp_queues(port)
+        sample = {
+            "time": elapsed,
+            "rss": read_rss(),
+            "traced": tracemalloc.get_traced_memory()[0] if args.trace else 0,
+            "rooms": len(server.rooms),
+            "clients": len(server.client_rooms),
+            "room_clients": sum(len(room.clients) for room in server.rooms.values()),
+            "handled": sum(len(values) for values in latencies.values()),
+            # {handler name: (handled, p50, p99)}
+            "handlers": {
+                handler: (len(values), percentile(values, 0.5), percentile(values, 0.99))
+                for handler, values in latencies.items()
+            },
+            "queues": queues,
+        }
+        samples.append(sample)
+        print(
+            f"{elapsed:7.1f}s rss {sample['rss'] / 2**20:7.2f}MB traced {sample['traced'] / 2**20:6.2f}MB"
+            f" rooms {sample['rooms']:4} clients {sample['room_clients']:5} handled {sample['handled']:6}"
+            + "".join(
+                f" {handler} p50 {p50 * 1000:.3f}ms p99 {p99 * 1000:.3f}ms"
+                for handler, (_, p50, p99) in sorted(sample["handlers"].items())
+            )
+            + (f" udp tx {queues[0]} rx {queues[1]} drops {queues[2]}" if queues else "")
+        )
+        if args.trace and elapsed >= args.warmup and not snapshots:
+            snapshots.append(tracemalloc.take_snapshot())
+
+        if elapsed >= args.duration and (not clients.is_alive() or elapsed >= args.duration + SOAK_GRACE):
+            server.running = False
+
+    server = SoakRoomServer(sock, args.lanes + 1, args.interval, on_sample)
+    clients.start()
+    child_conn.close()
+    try:
+        server.run()
+    finally:
+        clients.join(1)
+        if clients.is_alive():
+            clients.terminate()
+        totals = parent_conn.recv() if parent_conn.poll() else None
+        sock.close()
+
+    if args.trace:
+        snapshots.append(tracemalloc.take_snapshot())
+        tracemalloc.stop()
+
+    return report_soak(args, samples, snapshots, totals)
+
+
+def report_soak(args, samples, snapshots, totals):
+    print()
+    if totals is not None:
+        print(
+            f"matches: {totals['matches']}, games ended: {totals['games']},"
+            f" client errors: {totals['errors']}, abandoned watchers: {totals['abandoned']}"
+        )
+    else:
+        print("clients did not report, they were still running at the end")
+    if samples:
+        print(f"clients left in rooms after the run: {samples[-1]['room_clients']}")
+
+    # Only the samples with matches starting, the last ones only see the final matches wind down
+    measured = [sample for sample in samples if args.warmup <= sample["time"] <= args.duration]
+    if len(measured) < 2 * SOAK_WINDOWS:
+        print(f"FAIL: only {len(measured)} samples between the warm-up and the end, run longer or sample more often")
+        return 1
+    first, last = measured[:SOAK_WINDOWS], measured[-SOAK_WINDOWS:]
+
+    def average(window, key):
+        return sum(sample[key] for sample in window) / len(window)
+
+    def median(window, handler, column):
+        # Only the samples in which the handler ran, None if it never ran in the window
+        values = sorted(sample["handlers"][handler][column] for sample in window if handler in sample["handlers"])
+        return values[len(values) // 2] if values else None
+
+    rss_growth = (average(last, "rss") - average(first, "rss")) / 2**20
+    traced_growth = (average(last, "traced") - average(first, "traced")) / 2**20
+
+    failures = []
+    if rss_growth > args.max_rss_growth:
+        failures.append(f"RSS grew {rss_growth:.2f}MB (limit {args.max_rss_growth}MB)")
+    if args.trace and traced_growth > args.max_traced_growth:
+        failures.append(f"traced memory grew {traced_growth:.2f}MB (limit {args.max_traced_growth}MB)")
+
+    print(f"RSS growth: {rss_growth:+.2f}MB")
+    if args.trace:
+        print(f"traced growth: {traced_growth:+.2f}MB")
+
+    handlers = sorted({handler for sample in first + last for handler in sample["handlers"]})
+    for handler in handlers:
+        p99_first, p99_last = median(first, handler, 2), median(last, handler, 2)
+        if p99_first is None or p99_last is None:
+            print(f"{handler}: not handled at both ends of the run, no drift check")
+            continue
+        p50_first, p50_last = median(first, handler, 1), median(last, handler, 1)
+        p99_ratio = p99_last / p99_first if p99_first else 1.0
+        print(
+            f"{handler}: p50 {p50_first * 1000:.3f}ms -> {p50_last * 1000:.3f}ms,"
+            f" p99 {p99_first * 1000:.3f}ms -> {p99_last * 1000:.3f}ms (x{p99_ratio:.2f})"
+        )
+        if p99_ratio > args.max_p99_ratio and p99_last * 1000 > args.p99_floor_ms:
+            failures.append(
+                f"{handler} p99 went from {p99_first * 1000:.3f}ms to {p99_last * 1000:.3f}ms"
+                f" (limit x{args.max_p99_ratio})"
+            )
+
+    if len(snapshots) == 2:
+        print("top allocators by growth since the warm-up:")
+        for stat in snapshots[1].compare_to(snapshots[0], "lineno")[: args.top]:
+            print(f"  {stat}")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        return 1
+    print("PASS")
+    return 0
+
+
+def wait_for_server(port, timeout=10):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.1)
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            sock.sendto(message_util.create_ping_message(0, 0), ("127.0.0.1", port))
+            try:
+                sock.recvfrom(1024)
+                return
+            except socket.timeout:
+                pass
+    finally:
+        sock.close()
+    raise TimeoutError("Server did not start")
+
+
+def run_throughput_load(port, rooms, duration, conn):
+    """Plays back and forth moves in the given rooms, each player moving again once it got an answer."""
+    server = ("127.0.0.1", port)
+    players = {}  # {socket: [direction, time of the last move]}
+    for room in rooms:
+        for role, direction in ((cman_server.ClientRole.CMAN, game.Direction.RIGHT),
+                                (cman_server.ClientRole.SPIRIT, game.Direction.LEFT)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(2)
+            sock.sendto(message_util.create_join_message(role, room), server)
+            sock.recvfrom(2048)
+            sock.setblocking(False)
+            players[sock] = [direction, 0]
+
+    moves = 0
+    resent = 0
+    deadline = time.monotonic() + duration
+
+    def move(sock, now):
+        player = players[sock]
+        # RIGHT and LEFT alternate, the players only ever step back and forth on their start row
+        player[0] = game.Direction.LEFT if player[0] == game.Direction.RIGHT else game.Direction.RIGHT
+        player[1] = now
+        sock.sendto(message_util.create_player_movement_message(player[0]), server)
+
+    now = time.monotonic()
+    for sock in players:
+        move(sock, now)
+    while now < deadline:
+        readable, _, _ = select.select(list(players), [], [], RESEND_TIMEOUT)
+        now = time.monotonic()
+        for sock in readable:
+            try:
+                while True:
+                    sock.recvfrom(2048)
+            except BlockingIOError:
+                pass
+            moves += 1
+            move(sock, now)
+        for sock, (_, moved) in players.items():
+            if now - moved > RESEND_TIMEOUT:
+                resent += 1
+                move(sock, now)
+
+    for sock in players:
+        sock.sendto(message_util.create_quit_message(), server)
+        sock.close()
+    conn.send((moves, resent))
+    conn.close()
+
+
+def bench_throughput(args):
+    """Answered moves per second of a server started with each of the given worker counts.
+
+    Every datagram of a multi-worker server passes through the single
+    dispatcher process (recvfrom, address header, sendto), so its
+    throughput is capped by what that one Python loop forwards per second,
+    whatever the number of workers.
+    """
+    rooms = list(range(1, args.rooms + 1))
+    for workers in args.workers:
+        command = [sys.executable, "cman_server.py", "-p", str(args.port), "-w", str(workers)]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        try:
+            wait_for_server(args.port)
+            loaders = []
+            for index in range(args.loaders):
+                parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(
+                    target=run_throughput_load,
+                    args=(args.port, rooms[index::args.loaders], args.duration, child_conn),
+                )
+                process.start()
+                child_conn.close()
+                loaders.append((process, parent_conn))
+
+            moves = resent = 0
+            for process, conn in loaders:
+                loader_moves, loader_resent = conn.recv()
+                moves += loader_moves
+                resent += loader_resent
+                process.join()
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(f"workers {workers}: {moves / args.duration:8.0f} moves/s ({resent} unanswered moves resent)")
+    print(f"cpus: {os.cpu_count()}, load processes: {args.loaders}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parser")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    rooms = subparsers.add_parser("rooms", help="Memory per idle room")
+    rooms.add_argument("-n", "--count", type=int, default=4096, help="Number of rooms (default: 4096)")
+    rooms.set_defaults(func=bench_rooms)
+
+    snapshot = subparsers.add_parser("snapshot", help="Snapshot and restore time")
+    snapshot.add_argument("-n", "--count", type=int, default=4096, help="Number of rooms (default: 4096)")
+    snapshot.add_argument("-r", "--repeat", type=int, default=5, help="Repetitions (default: 5)")
+    snapshot.set_defaults(func=bench_snapshot)
+
+    bitboard = subparsers.add_parser("bitboard", help="Bitboard engine correctness and speed")
+    bitboard.add_argument("-g", "--games", type=int, default=200, help="Random games to check (default: 200)")
+    bitboard.add_argument("-m", "--moves", type=int, default=1000, help="Move limit per checked game (default: 1000)")
+    bitboard.add_argument("-d", "--depth", type=int, default=14, help="Minimax depth (default: 14)")
+    bitboard.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    bitboard.set_defaults(func=bench_bitboard)
+
+    maps = subparsers.add_parser("maps", help="Map load time, text against pack")
+    maps.add_argument("-r", "--repeat", type=int, default=1000, help="Repetitions (default: 1000)")
+    maps.add_argument("--pack", type=str, default="bench.cmpk", help="Pack file to compile (default: bench.cmpk)")
+    maps.set_defaults(func=bench_maps)
+
+    throughput = subparsers.add_parser("throughput", help="Moves per second by worker count")
+    throughput.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare (default: 1 2 4)")
+    throughput.add_argument("-n", "--rooms", type=int, default=64, help="Rooms with two players each (default: 64)")
+    throughput.add_argument("-t", "--duration", type=float, default=10, help="Seconds per worker count (default: 10)")
+    throughput.add_argument("-l", "--loaders", type=int, default=max(2, os.cpu_count() or 1), help="Load processes (default: CPUs, at least 2)")
+    throughput.add_argument("-p", "--port", type=int, default=1337, help="Server port (default: 1337)")
+    throughput.set_defaults(func=bench_throughput)
+
+    soak = subparsers.add_parser("soak", help="Memory growth and latency drift over many matches")
+    soak.add_argument("-t", "--duration", type=float, default=60, help="Seconds to start new matches for (default: 60)")
+    soak.add_argument("-n", "--lanes", type=int, default=20, help="Rooms playing at the same time (default: 20)")
+    soak.add_argument("-i", "--interval", type=float, default=2, help="Seconds between two samples (default: 2)")
+    soak.add_argument("-w", "--warmup", type=float, default=10, help="Seconds ignored before the baseline (default: 10)")
+    soak.add_argument("--max-moves", type=int, default=200, help="Move limit of the player who quits (default: 200)")
+    soak.add_argument("--move-interval", type=float, default=0.02, help="Seconds between two moves (default: 0.02)")
+    soak.add_argument("--idle-timeout", type=float, default=5, help="Seconds a player waits for the server (default: 5)")
+    soak.add_argument("--abandon", type=float, default=0, help="Share of watchers leaving without a quit (default: 0)")
+    soak.add_argument("--end-repeats", type=int, default=1, help="Game end messages per game (default: 1)")
+    soak.add_argument("--end-interval", type=float, default=0.05, help="Seconds between game end messages (default: 0.05)")
+    soak.add_argument("--no-trace", dest="trace", action="store_false", help="Skip tracemalloc, it slows the handlers")
+    soak.add_argument("--top", type=int, default=10, help="Allocators listed in the report (default: 10)")
+    soak.add_argument("--max-rss-growth", type=float, default=16, help="RSS growth limit in MB (default: 16)")
+    soak.add_argument("--max-traced-growth", type=float, default=2, help="Traced memory growth limit in MB (default: 2)")
+    soak.add_argument("--max-p99-ratio", type=float, default=2, help="p99 latency growth limit of each handler as a ratio (default: 2)")
+    soak.add_argument("--p99-floor-ms", type=float, default=1, help="p99 below this never fails (default: 1)")
+    soak.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    soak.set_defaults(func=bench_soak)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
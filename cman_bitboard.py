@@ -0,0 +1,295 @@
+import cman_game as game
+import cman_game_map as gm
+
+INFINITY = float("inf")
+
+
+class BitMap():
+    """
+
+    Bitboard view of a GameMap, shared by every BitState on the same map.
+
+    Cell (row, col) is bit row * cols + col, so moving up or down is a shift by cols and moving left or right
+    a shift by one. The map border is always a wall, so a shift never wraps around into a passable cell.
+
+    """
+    __slots__ = ('rows', 'cols', 'walls', 'passable', 'points', 'point_cells', 'start_bits')
+
+    def __init__(self, game_map):
+        """
+
+        Parameters:
+
+        game_map (cman_game.GameMap): the parsed map
+
+        """
+        self.rows, self.cols = game_map.board_dims
+        self.walls = 0
+        self.passable = 0
+        for i, row in enumerate(game_map.board):
+            for j, char in enumerate(row):
+                bit = 1 << (i * self.cols + j)
+                if char in gm.PASS_CHARS:
+                    self.passable |= bit
+                else:
+                    self.walls |= bit
+
+        # Same order as GameMap.point_bits, which is the order of the collected bitmask on the wire
+        self.point_cells = tuple(self.to_bit(coords) for coords in game_map.point_bits)
+        self.points = 0
+        for bit in self.point_cells:
+            self.points |= bit
+        self.start_bits = tuple(self.to_bit(coords) for coords in game_map.start_coords)
+
+    def to_bit(self, coords):
+        return 1 << (coords[0] * self.cols + coords[1])
+
+    def to_coords(self, bit):
+        return divmod(bit.bit_length() - 1, self.cols)
+
+    def shift(self, bit, direction):
+        """
+
+        Returns:
+
+        int: bit moved one cell in direction, whether that cell is passable or not
+
+        """
+        if direction == game.Direction.UP:
+            return bit >> self.cols
+        if direction == game.Direction.DOWN:
+            return bit << self.cols
+        if direction == game.Direction.LEFT:
+            return bit >> 1
+        return bit << 1
+
+_bitmaps = {}
+
+def load_bitmap(map_path):
+    """
+
+    Returns the BitMap of a map, building it only the first time it is requested.
+
+    Parameters:
+
+    map_path (str): a path to the textual map file or a map pack
+
+    """
+    bitmap = _bitmaps.get(map_path)
+    if bitmap is None:
+        bitmap = _bitmaps[map_path] = BitMap(game.load_map(map_path))
+    return bitmap
+
+
+class BitState():
+    """
+
+    Immutable game state over a BitMap.
+
+    Moves return a new state and never touch the old one, so copying is free and undoing a move is just
+    going back to the previous object. Transitions follow cman_game.Game.apply_move exactly.
+
+    """
+    __slots__ = ('bitmap', 'cman', 'spirit', 'points', 'lives', 'score', 'state', 'winner')
+
+    def __init__(self, bitmap, cman, spirit, points, lives, score, state, winner):
+        self.bitmap = bitmap
+        self.cman = cman
+        self.spirit = spirit
+        self.points = points
+        self.lives = lives
+        self.score = score
+        self.state = state
+        self.winner = winner
+
+    @classmethod
+    def initial(cls, bitmap, state=game.State.WAIT):
+        """
+
+        Returns:
+
+        BitState: A freshly restarted game, as after Game.restart_game()
+
+        """
+        return cls(bitmap, bitmap.start_bits[0], bitmap.start_bits[1], bitmap.points,
+                   game.MAX_ATTEMPTS, 0, state, None)
+
+    @classmethod
+    def from_game(cls, g, bitmap=None):
+        """
+
+        Parameters:
+
+        g (cman_game.Game): the game to convert
+
+        bitmap (BitMap): the bitmap of g's map, built from it when omitted
+
+        """
+        if bitmap is None:
+            bitmap = BitMap(g.map)
+        points = 0
+        for bit, (coords, wire_bit) in zip(bitmap.point_cells, g.map.point_bits.items()):
+            if not g.collected & wire_bit:
+                points |= bit
+        cman, spirit = (bitmap.to_bit(coords) for coords in g.cur_coords)
+        return cls(bitmap, cman, spirit, points, g.lives, g.score, g.state, g.winner)
+
+    def get_current_players_coords(self):
+        return [self.bitmap.to_coords(self.cman), self.bitmap.to_coords(self.spirit)]
+
+    def get_collected(self):
+        """
+
+        Returns:
+
+        int: The collected points bitmask in the same format as Game.get_collected()
+
+        """
+        collected = 0
+        for bit in self.bitmap.point_cells:
+            collected = (collected << 1) | (0 if self.points & bit else 1)
+        return collected
+
+    def get_winner(self):
+        return self.winner if self.state == game.State.WIN else game.Player.NONE
+
+    def can_move(self, player):
+        return self.state == game.State.PLAY or (self.state == game.State.START and player == game.Player.CMAN)
+
+    def apply_move(self, player, direction):
+        """
+
+        Applies a single movement.
+
+        Parameters:
+
+        player (Player): The player to move
+
+        direction (Direction): The direction of movement
+
+        Returns:
+
+        BitState: The new state, or None if the move was not applied (where Game.apply_move returns False)
+
+        """
+        if not self.can_move(player):
+            return None
+
+        bitmap = self.bitmap
+        moved = self.cman if player == game.Player.CMAN else self.spirit
+        moved = bitmap.shift(moved, direction)
+        if not moved & bitmap.passable:
+            return None
+
+        cman, spirit = self.cman, self.spirit
+        points, lives, score = self.points, self.lives, self.score
+        state, winner = game.State.PLAY, self.winner
+
+        if player == game.Player.CMAN:
+            cman = moved
+            if points & moved:
+                points &= ~moved
+                score += 1
+                if score >= game.WIN_SCORE and state != game.State.WIN:
+                    state, winner = game.State.WIN, game.Player.CMAN
+        else:
+            spirit = moved
+
+        if cman == spirit:
+            lives -= 1
+            if lives <= 0:
+                if state != game.State.WIN:
+                    state, winner = game.State.WIN, game.Player.SPIRIT
+            else:
+                # Game.next_round() resets the round even right after a win, and so do we
+                cman, spirit = bitmap.start_bits
+                state = game.State.START
+
+        return BitState(bitmap, cman, spirit, points, lives, score, state, winner)
+
+    def successors(self, player):
+        """
+
+        Returns:
+
+        list(tuple(Direction, BitState)): Every move player may apply and its resulting state
+
+        """
+        result = []
+        for direction in game.Direction:
+            child = self.apply_move(player, direction)
+            if child is not None:
+                result.append((direction, child))
+        return result
+
+    def key(self):
+        return (self.cman, self.spirit, self.points, self.lives, self.score, self.state, self.winner)
+
+    def __eq__(self, other):
+        return isinstance(other, BitState) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def evaluate(state):
+    """
+
+    Scores a state from the Spirit's point of view, higher is better for the Spirit.
+
+    """
+    if state.state == game.State.WIN:
+        return INFINITY if state.winner == game.Player.SPIRIT else -INFINITY
+    c_row, c_col = state.bitmap.to_coords(state.cman)
+    s_row, s_col = state.bitmap.to_coords(state.spirit)
+    distance = abs(c_row - s_row) + abs(c_col - s_col)
+    return (game.MAX_ATTEMPTS - state.lives) * game.WIN_SCORE - state.score - distance / 100
+
+
+def minimax(state, depth, player=game.Player.SPIRIT, alpha=-INFINITY, beta=INFINITY, counter=None):
+    """
+
+    Alpha-beta search with the two players moving in turns.
+
+    Parameters:
+
+    state (BitState): The position to search from
+
+    depth (int): The number of plies to look ahead
+
+    player (Player): The player to move first
+
+    counter (list[int]): If given, counter[0] is increased by the number of expanded nodes
+
+    Returns:
+
+    tuple(float, Direction): The value of the position for the Spirit and player's best move (None if it has none)
+
+    """
+    if counter is not None:
+        counter[0] += 1
+    children = state.successors(player) if depth > 0 and state.state != game.State.WIN else []
+    if not children:
+        return evaluate(state), None
+
+    other = game.Player.CMAN if player == game.Player.SPIRIT else game.Player.SPIRIT
+    best_move = children[0][0]
+    if player == game.Player.SPIRIT:
+        best = -INFINITY
+        for direction, child in children:
+            value = minimax(child, depth - 1, other, alpha, beta, counter)[0]
+            if value > best:
+                best, best_move = value, direction
+            alpha = max(alpha, best)
+            if alpha >= beta:
+                break
+    else:
+        best = INFINITY
+        for direction, child in children:
+            value = minimax(child, depth - 1, other, alpha, beta, counter)[0]
+            if value < best:
+                best, best_move = value, direction
+            beta = min(beta, best)
+            if alpha >= beta:
+                break
+    return best, best_move
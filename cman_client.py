@@ -4,8 +4,14 @@ import message_util
 import cman_utils
 from enum import IntEnum
 import cman_game_map
-import select
+import sys
+import threading
 import time
+import cman_netstats
+
+DEFAULT_FPS = 20
+INPUT_INTERVAL = 0.1
+RECEIVE_TIMEOUT = 0.2
 
 
 class ClientRole(IntEnum):
@@ -15,13 +21,36 @@ class ClientRole(IntEnum):
 
 
 class GameClient:
-    def __init__(self, server_host, server_port, role, socket_input):
+    def __init__(
+        self,
+        server_host,
+        server_port,
+        role,
+        socket_input,
+        room=None,
+        show_stats=False,
+        fps=DEFAULT_FPS,
+        map_path="map.txt",
+    ):
         self.server_address = (server_host, server_port)
         self.socket = socket_input
         self.role = ClientRole[role.upper()]
+        self.room = room
+        self.show_stats = show_stats
+        self.stats = cman_netstats.NetStats()
         self.can_move = False
         self.running = True
-        self.map_path = "map.txt"
+        self.map_path = map_path
+        self.pending_messages = []
+        cman_game_map.load_layout(map_path)  # the first frame must not wait for the map to load
+
+        # The receiver thread only stores the latest message, the render
+        # thread draws it at most fps times per second.
+        self.frame_interval = 1 / fps
+        self.render_condition = threading.Condition()
+        self.latest_state = None
+        self.latest_end = None
+        self.error = None
 
         self.movement_keys = {
             "w": 0,  # UP
@@ -37,10 +66,19 @@ class GameClient:
             print(f"Error sending message: {e}")
             self.cleanup()
 
+    def receive_messages(self):
+        # Messages that arrived bundled with an earlier one come first
+        if self.pending_messages:
+            messages, self.pending_messages = self.pending_messages, []
+            return messages
+        data, _ = self.socket.recvfrom(message_util.MAX_BUNDLE_SIZE)
+        return message_util.decode_messages(data)
+
     def receive_message(self):
         try:
-            data, _ = self.socket.recvfrom(1024)
-            return message_util.decode_message(data)
+            messages = self.receive_messages()
+            self.pending_messages = messages[1:]
+            return messages[0]
         except socket.timeout:
             raise socket.timeout
         except Exception as e:
@@ -55,21 +93,54 @@ class GameClient:
         self.socket.close()
         self.running = False
 
-    def handle_game_state(self, state_data):
-        cman_utils.clear_print()
+    def ping_loop(self):
+        while self.running:
+            try:
+                ping_message = self.stats.create_ping(time.perf_counter())
+                self.socket.sendto(ping_message, self.server_address)
+            except OSError:
+                break
+            time.sleep(cman_netstats.PING_INTERVAL)
+
+    def handle_pong(self, pong_data):
+        rtt = self.stats.handle_pong(pong_data, time.perf_counter())
+        if self.stats.is_outlier(rtt):
+            print(
+                f"Slow round trip: {rtt * 1000:.1f}ms (server {self.stats.last_server_time * 1000:.2f}ms)",
+                file=sys.stderr,
+            )
+
+    def update_state(self, state_data):
         if len(state_data) < 5:
             raise ValueError("Invalid state data.")
-        cman_game_map.print_map(self.map_path, state_data)
         freeze, coords_c, coords_s, attempts, collected = state_data
         self.can_move = not freeze if self.role != ClientRole.WATCHER else False
 
+    def render_state(self, state_data):
+        render_start = time.perf_counter()
+        cman_utils.clear_print()
+        footer = self.stats.format() if self.show_stats else None
+        cman_game_map.print_map(self.map_path, state_data, footer)
+        self.stats.render_time = time.perf_counter() - render_start
+
+    def handle_game_state(self, state_data):
+        self.update_state(state_data)
+        self.render_state(state_data)
+
     def join_game(self):
-        join_message = message_util.create_join_message(self.role)
+        join_message = message_util.create_join_message(self.role, self.room)
         self.send_message(join_message)
 
         response = self.receive_message()
         message_type = response[0]
 
+        if message_type == message_util.OPCODE_REDIRECT:
+            # A lobby answered, join the node and room it picked instead
+            _, host, port, room = response
+            self.server_address = (host, port)
+            self.room = room
+            return self.join_game()
+
         if message_type == message_util.OPCODE_ERROR:
             self.cleanup(response[1].decode("utf-8"))
             return False
@@ -110,39 +181,93 @@ class GameClient:
         if self.role != ClientRole.WATCHER:
             self.running = False
 
+    def receive_loop(self):
+        self.socket.settimeout(RECEIVE_TIMEOUT)
+        while self.running:
+            try:
+                responses = self.receive_messages()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            except Exception as e:
+                print(f"Error in receive loop: {e}", file=sys.stderr)
+                continue
+
+            for response in responses:
+                if not self.handle_response(response):
+                    return
+
+    def handle_response(self, response):
+        """Hands a received message to the render thread, returns False once nothing more is expected."""
+        message_type = response[0]
+        if message_type == message_util.OPCODE_PONG:
+            self.handle_pong(response)
+            return True
+
+        with self.render_condition:
+            if message_type == message_util.OPCODE_ERROR:
+                self.error = response[1:]
+                self.running = False
+            elif message_type == message_util.OPCODE_GAME_STATE_UPDATE:
+                self.update_state(response[1:])
+                self.latest_state = response[1:]
+            elif message_type == message_util.OPCODE_GAME_END:
+                self.latest_end = response[1:]
+                if self.role != ClientRole.WATCHER:
+                    self.can_move = False
+                    self.render_condition.notify()
+                    return False
+            self.render_condition.notify()
+        return self.running
+
+    def render_loop(self):
+        while self.running:
+            with self.render_condition:
+                if self.latest_state is None and self.latest_end is None:
+                    self.render_condition.wait(self.frame_interval)
+                state_data, end_data = self.latest_state, self.latest_end
+                if end_data is not None:
+                    # Show the end screen first, a newer state waits for the next frame
+                    self.latest_end = None
+                    state_data = None
+                else:
+                    self.latest_state = None
+
+            frame_start = time.perf_counter()
+            try:
+                if end_data is not None:
+                    self.handle_game_end(end_data)
+                elif state_data is not None:
+                    self.render_state(state_data)
+                else:
+                    continue
+            except Exception as e:
+                print(f"Error in render loop: {e}")
+                self.running = False
+                break
+
+            time.sleep(max(0, self.frame_interval - (time.perf_counter() - frame_start)))
+
     def run(self):
         if not self.join_game():
             self.cleanup()
             return
 
+        threads = [
+            threading.Thread(target=self.receive_loop, daemon=True),
+            threading.Thread(target=self.render_loop, daemon=True),
+            threading.Thread(target=self.ping_loop, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
         while self.running:
             try:
-
                 if self.check_quit():
                     break
-
-                readable, sendable, _ = select.select(
-                    [self.socket], [self.socket], [], 0.1
-                )
-                if readable:
-                    try:
-                        response = self.receive_message()
-                        if response:
-                            message_type = response[0]
-                            if message_type == message_util.OPCODE_ERROR:
-                                print(f"Error: {response[1:]}")
-                                break
-                            elif message_type == message_util.OPCODE_GAME_STATE_UPDATE:
-                                self.handle_game_state(response[1:])
-                            elif message_type == message_util.OPCODE_GAME_END:
-                                self.handle_game_end(response[1:])
-                                if self.role != ClientRole.WATCHER:
-                                    break
-                    except socket.timeout:
-                        pass
-
                 self.check_movement()
-                time.sleep(0.1)
+                time.sleep(INPUT_INTERVAL)
             except KeyboardInterrupt:
                 quit_message = message_util.create_quit_message()
                 self.send_message(quit_message)
@@ -150,6 +275,14 @@ class GameClient:
             except Exception as e:
                 print(f"Error in game loop: {e}")
                 break
+
+        self.running = False
+        with self.render_condition:
+            self.render_condition.notify_all()
+        for thread in threads[:2]:
+            thread.join()
+        if self.error is not None:
+            print(f"Error: {self.error}")
         self.cleanup()
 
 
@@ -178,10 +311,37 @@ def main():
         default=1337,
         help="Port number to use (default: 1337)",
     )
+    parser.add_argument(
+        "-r",
+        "--room",
+        type=int,
+        default=None,
+        help="Room to join (default: the server's default room)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Show RTT, jitter and loss under the board",
+    )
+    parser.add_argument(
+        "--fps",
+        type=float,
+        default=DEFAULT_FPS,
+        help=f"Maximum board redraws per second (default: {DEFAULT_FPS})",
+    )
+    parser.add_argument(
+        "-m",
+        "--map",
+        type=str,
+        default="map.txt",
+        help="Map file, or map pack as pack.cmpk[:name], the server's map (default: map.txt)",
+    )
 
     args = parser.parse_args()
     socket_input = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    client = GameClient(args.addr, args.port, args.role, socket_input)
+    client = GameClient(
+        args.addr, args.port, args.role, socket_input, args.room, args.stats, args.fps, args.map
+    )
     client.run()
 
 
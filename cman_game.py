@@ -1,6 +1,6 @@
 import cman_game_map as gm
-import os
 from enum import IntEnum
+from types import MappingProxyType
 
 MAX_ATTEMPTS = 3
 WIN_SCORE = 32
@@ -22,30 +22,95 @@ class State(IntEnum):
 	PLAY = 2	# Round has started
 	WIN = 3		# Game ended
 
+class GameMap():
+	"""
+
+	Geometry of a single map: the board, its dimensions, the start coordinates and the point index.
+
+	Instances are read-only and shared by every game played on the same map, use load_map() to get one.
+
+	"""
+	__slots__ = ('board', 'board_dims', 'start_coords', 'point_bits')
+
+	def __init__(self, layout):
+		"""
+
+		Builds the geometry of a loaded map.
+
+		Parameters:
+
+		layout (cman_game_map.MapLayout): the map, as returned by cman_game_map.load_layout()
+
+		"""
+		self.board = layout.board()
+		self.board_dims = (layout.rows, layout.cols)
+		self.start_coords = tuple(layout.to_coords(cell) for cell in layout.start_cells)
+
+		# Points are numbered in row-major order, the first point is the most significant bit
+		# of the collected bitmask, exactly as sent to the clients.
+		point_count = len(layout.point_cells)
+		self.point_bits = {layout.to_coords(cell): 1 << (point_count - 1 - k) for k, cell in enumerate(layout.point_cells)}
+
+_maps = {}  # {map path: GameMap}, several paths may share a GameMap when their contents are the same
+_maps_by_digest = {}
+
+def load_map(map_path):
+	"""
+
+	Returns the GameMap of a map, parsing or unpacking it only the first time it is requested.
+
+	Parameters:
+
+	map_path (str): a path to a textual map file or a map pack, see cman_game_map.load_layout()
+
+	Returns:
+
+	GameMap: The shared geometry of the map
+
+	"""
+	game_map = _maps.get(map_path)
+	if game_map is None:
+		layout = gm.load_layout(map_path)
+		game_map = _maps_by_digest.get(layout.digest)
+		if game_map is None:
+			game_map = _maps_by_digest[layout.digest] = GameMap(layout)
+		_maps[map_path] = game_map
+	return game_map
+
 class Game():
+	__slots__ = ('map', 'cur_coords', 'score', 'collected', 'lives', 'state', 'winner')
+
 	def __init__(self, map_path):
 		"""
 
 		Creates a new game instance.
 
+		Only the per-game state is stored here, the map geometry is shared between all games on the same map.
+
 		Parameters:
 
-		map_path (str): a path to the textual map file
+		map_path (str): a path to the textual map file or a map pack
 
 		"""
-		assert os.path.isfile(map_path), "map file does not exist."
-		self.board = gm.read_map(map_path).split('\n')
-		self.board_dims = (len(self.board), len(self.board[0]))
+		self.map = load_map(map_path)
+		self.restart_game()
 
-		self.start_coords = []
-		for p_char in gm.PLAYER_CHARS:
-			start_row = [p_char in row for row in self.board].index(True)
-			self.start_coords.append((start_row, self.board[start_row].index(p_char)))
+	@property
+	def board(self):
+		return self.map.board
 
-		self.points = {(i,j):1 for i in range(self.board_dims[0])
-							   for j in range(self.board_dims[1])
-							   if self.board[i][j] == gm.POINT_CHAR}
-		self.restart_game()
+	@property
+	def board_dims(self):
+		return self.map.board_dims
+
+	@property
+	def start_coords(self):
+		return self.map.start_coords
+
+	@property
+	def points(self):
+		# Read-only, points are collected through the bitmask, writing to a copy would silently do nothing
+		return MappingProxyType(self.get_points())
 
 	def restart_game(self):
 		"""
@@ -53,11 +118,9 @@ class Game():
 		Restarts all the variables of this game instance to their initial values.
 
 		"""
-		self.cur_coords = self.start_coords[::]
-		print(self.cur_coords)
+		self.cur_coords = list(self.map.start_coords)
 		self.score = 0
-		for p in self.points.keys():
-			self.points[p] = 1
+		self.collected = 0
 		self.lives = MAX_ATTEMPTS
 		self.state = State.WAIT
 		self.winner = None
@@ -68,7 +131,7 @@ class Game():
 		Moves all player coordinates to their starting coordinates and enable legal moves to be processed.
 
 		"""
-		self.cur_coords = self.start_coords[::]
+		self.cur_coords = list(self.map.start_coords)
 		self.state = State.START
 
 	def get_current_players_coords(self):
@@ -101,7 +164,17 @@ class Game():
 		Collected points will have a value of 0, uncollected will have a value of 1
 
 		"""
-		return self.points
+		return {coords: 0 if self.collected & bit else 1 for coords, bit in self.map.point_bits.items()}
+
+	def get_collected(self):
+		"""
+		
+		Returns:
+
+		int: A bitmask of the collected points in this game instance, the first point of the map being the most significant bit
+
+		"""
+		return self.collected
 
 	def get_winner(self):
 		"""
@@ -182,9 +255,10 @@ class Game():
 		else:
 			self.state = State.PLAY
 			self.cur_coords[player] = next_coords
-			if player == Player.CMAN and next_coords in self.points.keys():
-				self.score += self.points[next_coords]
-				self.points[next_coords] = 0
+			point_bit = self.map.point_bits.get(next_coords, 0)
+			if player == Player.CMAN and point_bit and not self.collected & point_bit:
+				self.score += 1
+				self.collected |= point_bit
 				if self.score >= WIN_SCORE:
 					self.declare_winner(Player.CMAN)
 			if (player == Player.CMAN and next_coords in self.cur_coords[1:]) or (player != Player.CMAN and next_coords == self.cur_coords[0]):
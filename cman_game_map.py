@@ -1,3 +1,9 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+
 CMAN_CHAR = 'C'
 SPIRIT_CHAR = 'S'
 PLAYER_CHARS = [CMAN_CHAR, SPIRIT_CHAR]
@@ -7,6 +13,13 @@ PASS_CHARS = [CMAN_CHAR, SPIRIT_CHAR, POINT_CHAR, FREE_CHAR]
 WALL_CHAR = 'W'
 MAX_POINTS = 40
 
+PACK_SUFFIX = '.cmpk'
+PACK_MAGIC = b'CMPK'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('!4sHH')  # magic, version, map count
+PACK_ENTRY = struct.Struct('!32s32sII')  # name, content hash, offset, length
+MAP_RECORD = struct.Struct('!BBHHH')  # rows, cols, cman cell, spirit cell, point count
+
 def read_map(path):
     """
 
@@ -38,11 +51,172 @@ def read_map(path):
 
         return map_data
     
+class MapLayout():
+    """
+
+    Validated map contents as cells: cell (row, col) is number row * cols + col.
+
+    A layout is what a map pack stores, it is built either from a pack record or by parsing a textual map once.
+
+    """
+    __slots__ = ('name', 'digest', 'rows', 'cols', 'walls', 'start_cells', 'point_cells', '_board')
+
+    def __init__(self, name, digest, rows, cols, walls, start_cells, point_cells):
+        self.name = name
+        self.digest = digest
+        self.rows = rows
+        self.cols = cols
+        self.walls = walls  # bitmap, bit k set when cell k is a wall
+        self.start_cells = start_cells  # (cman cell, spirit cell)
+        self.point_cells = point_cells  # sorted, so in row-major order
+        self._board = None
+
+    @classmethod
+    def from_text(cls, map_data, name=''):
+        """
+
+        Parameters:
+
+        map_data (str): a map as returned by read_map()
+
+        name (str): the name of the map inside a pack
+
+        """
+        lines = map_data.split('\n')
+        cols = len(lines[0])
+        cells = ''.join(lines)
+        walls = 0
+        for k, char in enumerate(cells):
+            if char == WALL_CHAR:
+                walls |= 1 << k
+        start_cells = (cells.index(CMAN_CHAR), cells.index(SPIRIT_CHAR))
+        point_cells = tuple(k for k, char in enumerate(cells) if char == POINT_CHAR)
+        digest = hashlib.sha256(map_data.encode('utf-8')).digest()
+        return cls(name, digest, len(lines), cols, walls, start_cells, point_cells)
+
+    def to_coords(self, cell):
+        return divmod(cell, self.cols)
+
+    def board(self):
+        """
+
+        Returns:
+
+        tuple(str): The map rows in the textual map format, as read_map() would return them
+
+        """
+        if self._board is None:
+            chars = [WALL_CHAR if self.walls >> k & 1 else FREE_CHAR for k in range(self.rows * self.cols)]
+            for k in self.point_cells:
+                chars[k] = POINT_CHAR
+            chars[self.start_cells[0]] = CMAN_CHAR
+            chars[self.start_cells[1]] = SPIRIT_CHAR
+            self._board = tuple(''.join(chars[i * self.cols:(i + 1) * self.cols]) for i in range(self.rows))
+        return self._board
+
+    def pack(self):
+        wall_bytes = self.walls.to_bytes((self.rows * self.cols + 7) // 8, 'big')
+        return (MAP_RECORD.pack(self.rows, self.cols, self.start_cells[0], self.start_cells[1], len(self.point_cells))
+                + struct.pack(f'!{len(self.point_cells)}H', *self.point_cells)
+                + wall_bytes)
+
+    @classmethod
+    def unpack(cls, buffer, offset, name, digest):
+        rows, cols, cman_cell, spirit_cell, point_count = MAP_RECORD.unpack_from(buffer, offset)
+        offset += MAP_RECORD.size
+        point_cells = struct.unpack_from(f'!{point_count}H', buffer, offset)
+        offset += 2 * point_count
+        wall_bytes = buffer[offset:offset + (rows * cols + 7) // 8]
+        walls = int.from_bytes(wall_bytes, 'big')
+        return cls(name, digest, rows, cols, walls, (cman_cell, spirit_cell), point_cells)
+
+def compile_pack(map_paths, pack_path):
+    """
+
+    Compiles textual maps into a single binary map pack.
+
+    Parameters:
+
+    map_paths (list[str]): paths to the textual map files, each map is named after its file
+
+    pack_path (str): path of the pack file to write
+
+    """
+    layouts = [MapLayout.from_text(read_map(path), os.path.splitext(os.path.basename(path))[0]) for path in map_paths]
+    records = [layout.pack() for layout in layouts]
+
+    offset = PACK_HEADER.size + PACK_ENTRY.size * len(layouts)
+    parts = [PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(layouts))]
+    for layout, record in zip(layouts, records):
+        name = layout.name.encode('utf-8')
+        assert len(name) <= 32, f"map name {layout.name} is too long."
+        parts.append(PACK_ENTRY.pack(name, layout.digest, offset, len(record)))
+        offset += len(record)
+    parts.extend(records)
+
+    with open(pack_path, 'wb') as f:
+        f.write(b''.join(parts))
+
+_packs = {}  # {pack path: (mmap, {name: (digest, offset)})}
+_layouts = {}  # {content hash: MapLayout}
+_specs = {}  # {map spec: content hash}
+
+def _open_pack(pack_path):
+    pack = _packs.get(pack_path)
+    if pack is None:
+        with open(pack_path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = PACK_HEADER.unpack_from(buffer)
+        assert magic == PACK_MAGIC and version == PACK_VERSION, "not a supported map pack."
+        index = {}
+        for i in range(count):
+            name, digest, offset, length = PACK_ENTRY.unpack_from(buffer, PACK_HEADER.size + i * PACK_ENTRY.size)
+            index[name.rstrip(b'\0').decode('utf-8')] = (digest, offset)
+        pack = _packs[pack_path] = (buffer, index)
+    return pack
+
+def load_layout(spec):
+    """
+
+    Loads a map, parsing or unpacking it only once per process.
+
+    Parameters:
+
+    spec (str): a textual map path, a pack path (its first map) or 'pack_path:map_name'
+
+    Returns:
+
+    MapLayout: The map layout, shared by everyone loading a map with the same content hash
+
+    """
+    digest = _specs.get(spec)
+    if digest is not None:
+        return _layouts[digest]
+
+    # Split after the pack suffix, a Windows path has a colon of its own (C:\maps\m.cmpk:level1)
+    split = spec.find(PACK_SUFFIX + ':')
+    pack_path, name = (spec, '') if split < 0 else (spec[:split + len(PACK_SUFFIX)], spec[split + len(PACK_SUFFIX) + 1:])
+    if pack_path.endswith(PACK_SUFFIX):
+        buffer, index = _open_pack(pack_path)
+        assert index, "map pack is empty."
+        name = name or next(iter(index))
+        assert name in index, f"map {name} is not in the pack."
+        digest, offset = index[name]
+        if digest not in _layouts:
+            _layouts[digest] = MapLayout.unpack(buffer, offset, name, digest)
+    else:
+        layout = MapLayout.from_text(read_map(spec))
+        digest = layout.digest
+        _layouts.setdefault(digest, layout)
+
+    _specs[spec] = digest
+    return _layouts[digest]
+
 def replace_char_at_index(s, index, char):
     return s[:index] + char + s[index + 1:]
     
     
-def print_map(path, state_data=None):
+def print_map(path, state_data=None, footer=None):
     visual_mapping = {
         FREE_CHAR: ' ',  # Free space
         WALL_CHAR: '█',  # Wall
@@ -51,22 +225,16 @@ def print_map(path, state_data=None):
         SPIRIT_CHAR: SPIRIT_CHAR   # Player S start
     }
     try:
-        map_data = read_map(path)
-        map_data = map_data.replace(CMAN_CHAR, FREE_CHAR)
-        map_data = map_data.replace(SPIRIT_CHAR, FREE_CHAR)
-
-        binary_string = bin(state_data[4])[2:].zfill(40)
-        binary_string = [int(bit) for bit in binary_string]
-
-        k = 0
-        for i, c in enumerate(map_data):
-            if c == POINT_CHAR:
-                if binary_string[k] == 1:
-                    map_data = replace_char_at_index(map_data, i, FREE_CHAR)
-                k += 1
+        layout = load_layout(path)
+        map_lines = [line.replace(CMAN_CHAR, FREE_CHAR).replace(SPIRIT_CHAR, FREE_CHAR) for line in layout.board()]
 
+        collected = state_data[4]
+        point_count = len(layout.point_cells)
+        for k, cell in enumerate(layout.point_cells):
+            if collected >> (point_count - 1 - k) & 1:
+                row, col = layout.to_coords(cell)
+                map_lines[row] = replace_char_at_index(map_lines[row], col, FREE_CHAR)
 
-        map_lines = map_data.split('\n')
         map_lines[state_data[1][0]] = replace_char_at_index(map_lines[state_data[1][0]], state_data[1][1], CMAN_CHAR )
         map_lines[state_data[2][0]] = replace_char_at_index(map_lines[state_data[2][0]], state_data[2][1], SPIRIT_CHAR )
 
@@ -79,10 +247,26 @@ def print_map(path, state_data=None):
             print(visual_line)
         
         print("=" * 30)
+        if footer:
+            print(footer)
     
     except AssertionError as e:
         print(f"Map validation error: {e}")
     except FileNotFoundError:
         print("Error: The file does not exist.")
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
\ No newline at end of file
+        print(f"An unexpected error occurred: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map compiler parser")
+    parser.add_argument("maps", nargs="+", help="Textual map files to compile")
+    parser.add_argument("-o", "--output", type=str, default="maps" + PACK_SUFFIX, help=f"Pack file to write (default: maps{PACK_SUFFIX})")
+    args = parser.parse_args()
+
+    compile_pack(args.maps, args.output)
+    print(f"Compiled {len(args.maps)} maps into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import select
+import socket
+import time
+from collections import deque
+
+import message_util
+from cman_server import ClientRole, SELECT_TIMEOUT
+
+NODE_TIMEOUT = 3  # seconds without a heartbeat before a node is considered dead
+PENDING_TIMEOUT = 30  # seconds a half-filled room is offered to the missing role
+FIRST_ROOM = 1  # room 0 is left to clients connecting to a node directly
+MAX_ROOM = 2**16 - 1
+
+
+class LobbyServer:
+    """Front-end that redirects joining clients to game server nodes.
+
+    Nodes report their load with periodic heartbeats. The first player of a
+    match gets a fresh room on the least loaded node, and that room is then
+    offered to the next player asking for the other role. Watchers follow the
+    most recently assigned room.
+    """
+
+    def __init__(self, port=1336, node_timeout=NODE_TIMEOUT):
+        self.port = port
+        self.socket_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_udp.bind(("127.0.0.1", port))
+        self.node_timeout = node_timeout
+
+        # A multi-process node reports once per worker, all under the same port
+        self.reporters = {}  # {source address: (node address, rooms, max_rooms, clients, last seen)}
+        self.next_room = {}  # {node address: next room id to hand out}
+        self.assigned = {}  # {node address: clients redirected since its last heartbeat}
+
+        self.open_rooms = {ClientRole.CMAN: deque(), ClientRole.SPIRIT: deque()}
+        self.last_room = None
+
+    def handle_heartbeat(self, source_addr, port, rooms, max_rooms, clients):
+        node_addr = (source_addr[0], port)
+        self.reporters[source_addr] = (node_addr, rooms, max_rooms, clients, time.time())
+        self.next_room.setdefault(node_addr, FIRST_ROOM)
+        self.assigned[node_addr] = 0
+
+    def get_nodes(self, now):
+        nodes = {}  # {node address: [rooms, max_rooms, clients]}
+        for source_addr, report in list(self.reporters.items()):
+            node_addr, rooms, max_rooms, clients, last_seen = report
+            if now - last_seen > self.node_timeout:
+                del self.reporters[source_addr]
+                continue
+            load = nodes.setdefault(node_addr, [0, 0, self.assigned.get(node_addr, 0)])
+            load[0] += rooms
+            load[1] += max_rooms
+            load[2] += clients
+        return nodes
+
+    def allocate_room(self, nodes):
+        available = [
+            (clients, rooms, node_addr)
+            for node_addr, (rooms, max_rooms, clients) in nodes.items()
+            if rooms < max_rooms
+        ]
+        if not available:
+            return None
+
+        node_addr = min(available)[2]
+        room = self.next_room[node_addr]
+        self.next_room[node_addr] = room + 1 if room < MAX_ROOM else FIRST_ROOM
+        return node_addr, room
+
+    def find_open_room(self, role, nodes, now):
+        open_rooms = self.open_rooms[role]
+        while open_rooms:
+            node_addr, room, created = open_rooms.popleft()
+            if node_addr in nodes and now - created <= PENDING_TIMEOUT:
+                return node_addr, room
+        return None
+
+    def handle_join_request(self, client_addr, role):
+        if role not in list(ClientRole):
+            self.send_error(client_addr, "Role does not exist")
+            return
+
+        now = time.time()
+        nodes = self.get_nodes(now)
+        role = ClientRole(role)
+
+        if role == ClientRole.WATCHER:
+            target = self.last_room
+            if target is None or target[0] not in nodes:
+                target = self.allocate_room(nodes)
+                if target is not None:
+                    for open_rooms in self.open_rooms.values():
+                        open_rooms.append(target + (now,))
+        else:
+            target = self.find_open_room(role, nodes, now)
+            if target is None:
+                target = self.allocate_room(nodes)
+                if target is not None:
+                    other = ClientRole.SPIRIT if role == ClientRole.CMAN else ClientRole.CMAN
+                    self.open_rooms[other].append(target + (now,))
+
+        if target is None:
+            self.send_error(client_addr, "No game server available")
+            return
+
+        node_addr, room = target
+        self.last_room = target
+        self.assigned[node_addr] = self.assigned.get(node_addr, 0) + 1
+        data = message_util.create_redirect_message(node_addr[0], node_addr[1], room)
+        self.socket_udp.sendto(data, client_addr)
+
+    def send_error(self, client_addr, message):
+        self.socket_udp.sendto(message_util.create_error_message(message), client_addr)
+
+    def run(self):
+        while True:
+            readable, _, _ = select.select([self.socket_udp], [], [], SELECT_TIMEOUT)
+
+            if readable:
+                try:
+                    data, addr = self.socket_udp.recvfrom(1024)
+                    message = message_util.decode_message(data)
+
+                    if message[0] == message_util.OPCODE_HEARTBEAT:
+                        self.handle_heartbeat(addr, *message[1:])
+                    elif message[0] == message_util.OPCODE_JOIN_REQUEST:
+                        self.handle_join_request(addr, message[1])
+                except socket.error:
+                    pass
+                except Exception as e:
+                    print(f"Error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lobby parser")
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=1336,
+        help="Port number to use (default: 1336)",
+    )
+    parser.add_argument(
+        "--node-timeout",
+        type=float,
+        default=NODE_TIMEOUT,
+        help=f"Seconds without a heartbeat before a node is dropped (default: {NODE_TIMEOUT})",
+    )
+    args = parser.parse_args()
+
+    lobby = LobbyServer(args.port, args.node_timeout)
+    lobby.run()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"Error in main: {e}")
@@ -0,0 +1,89 @@
+import threading
+from collections import deque
+
+import message_util
+
+PING_INTERVAL = 1  # seconds between two pings
+PING_TIMEOUT = 3  # seconds after which an unanswered ping counts as lost
+LOSS_WINDOW = 30  # pings the loss estimate is computed over
+SLOW_RTT_MS = 200
+
+
+class NetStats:
+    """Rolling RTT, jitter and loss estimates built from ping/pong exchanges.
+
+    The round trip is split into the time the server spent handling the ping
+    and the rest, which is the network (and the client's own receive loop).
+    """
+
+    def __init__(self, slow_rtt_ms=SLOW_RTT_MS):
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        self.pending = {}  # {seq: send time}
+        self.answered = deque(maxlen=LOSS_WINDOW)  # True for each answered ping, False for each lost one
+
+        self.rtt = None  # smoothed, seconds
+        self.last_rtt = None
+        self.jitter = 0.0
+        self.server_time = 0.0  # smoothed like the RTT, so the network share never exceeds it
+        self.last_server_time = 0.0
+        self.render_time = 0.0
+
+        self.slow_rtt = slow_rtt_ms / 1000
+        self.outliers = 0
+
+    def create_ping(self, now):
+        with self.lock:
+            for seq, sent in list(self.pending.items()):
+                if now - sent > PING_TIMEOUT:
+                    del self.pending[seq]
+                    self.answered.append(False)
+
+            seq = self.next_seq
+            self.next_seq = (seq + 1) % 2**32
+            self.pending[seq] = now
+        return message_util.create_ping_message(seq, now)
+
+    def handle_pong(self, message, now):
+        """Updates the estimates from a decoded pong, returns its RTT or None if it came too late."""
+        _, seq, client_time, server_recv_time, server_send_time = message
+        with self.lock:
+            if self.pending.pop(seq, None) is None:
+                return None
+            self.answered.append(True)
+
+            rtt = now - client_time
+            server_time = server_send_time - server_recv_time
+            if self.rtt is None:
+                self.rtt = rtt
+                self.server_time = server_time
+            else:
+                # RFC 6298 smoothing for the RTT, RFC 3550 for the jitter
+                self.rtt += (rtt - self.rtt) / 8
+                self.server_time += (server_time - self.server_time) / 8
+                self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+            self.last_rtt = rtt
+            self.last_server_time = server_time
+
+            if rtt > self.slow_rtt:
+                self.outliers += 1
+        return rtt
+
+    def is_outlier(self, rtt):
+        return rtt is not None and rtt > self.slow_rtt
+
+    def get_loss(self):
+        with self.lock:
+            if not self.answered:
+                return 0.0
+            return self.answered.count(False) / len(self.answered)
+
+    def format(self):
+        if self.rtt is None:
+            return "RTT: waiting for the first pong"
+        network = max(0.0, self.rtt - self.server_time)
+        return (
+            f"RTT {self.rtt * 1000:.1f}ms (network {network * 1000:.1f}ms, server {self.server_time * 1000:.2f}ms)"
+            f" | jitter {self.jitter * 1000:.1f}ms | loss {self.get_loss():.0%}"
+            f" | render {self.render_time * 1000:.1f}ms | slow {self.outliers}"
+        )
@@ -0,0 +1,107 @@
+import socket
+from collections import deque
+
+MAX_QUEUED = 64  # datagrams waiting per destination before the oldest are dropped
+SEND_STATS_INTERVAL = 10  # seconds between two send queue reports, only when something was deferred
+
+
+def set_buffer_sizes(sock, sndbuf=None, rcvbuf=None):
+    """Sets the kernel socket buffer sizes in bytes, None keeps the system default."""
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+
+class SendQueue:
+    """Non-blocking sends on a UDP socket, one outbound queue per destination.
+
+    A datagram is sent right away unless the kernel send buffer is full or the
+    destination already has a backlog, then it waits in the destination's queue
+    until flush() is called on a writable socket. A queued replaceable datagram
+    (a plain state update) is dropped as soon as a newer one to the same
+    destination is queued, and a full queue drops its state update first and
+    its oldest datagram otherwise, so a slow path loses stale states instead of
+    stalling the game loop.
+
+    Errors of a single send are counted and never raised, one bad destination
+    must not cut a broadcast short.
+    """
+
+    def __init__(self, sock, max_queued=MAX_QUEUED):
+        sock.setblocking(False)
+        self.socket_udp = sock
+        self.max_queued = max_queued
+        self.queues = {}  # {address: deque([(data, replaceable)])}
+
+        self.sent = 0
+        self.deferred = 0  # queued instead of sent right away
+        self.dropped = 0  # superseded or overflowed before they could be sent
+        self.failed = 0  # send errors other than a full buffer
+        self.last_error = None
+        self.reported = (0, 0, 0)
+
+    def send(self, data, address, replaceable=False):
+        queue = self.queues.get(address)
+        if queue is None:
+            try:
+                self.socket_udp.sendto(data, address)
+                self.sent += 1
+                return
+            except BlockingIOError:
+                queue = self.queues[address] = deque()
+            except OSError as e:
+                self.failed += 1
+                self.last_error = e
+                return
+
+        # Keep the order, everything after a deferred datagram is deferred too
+        if replaceable:
+            stale = [entry for entry in queue if entry[1]]
+            for entry in stale:
+                queue.remove(entry)
+            self.dropped += len(stale)
+        if len(queue) >= self.max_queued:
+            # Rather lose a state update, the next one repeats it, than an end or an error
+            stale = next((entry for entry in queue if entry[1]), queue[0])
+            queue.remove(stale)
+            self.dropped += 1
+        queue.append((data, replaceable))
+        self.deferred += 1
+
+    def pending(self):
+        return bool(self.queues)
+
+    def flush(self):
+        """Sends the queued datagrams until the socket buffer is full again."""
+        for address in list(self.queues):
+            queue = self.queues[address]
+            while queue:
+                try:
+                    self.socket_udp.sendto(queue[0][0], address)
+                    self.sent += 1
+                except BlockingIOError:
+                    return
+                except OSError as e:
+                    self.failed += 1
+                    self.last_error = e
+                queue.popleft()
+            del self.queues[address]
+
+    def changed(self):
+        """Returns True once per change of the deferred, dropped or failed counters."""
+        counters = (self.deferred, self.dropped, self.failed)
+        if counters == self.reported:
+            return False
+        self.reported = counters
+        return True
+
+    def format(self):
+        queued = sum(len(queue) for queue in self.queues.values())
+        text = (
+            f"sent {self.sent} | deferred {self.deferred} | dropped {self.dropped}"
+            f" | failed {self.failed} | queued {queued} to {len(self.queues)}"
+        )
+        if self.last_error is not None:
+            text += f" | last error: {self.last_error}"
+        return text
@@ -6,6 +6,7 @@ import json
 import time
 import message_util
 import select
+import cman_sendqueue
 
 # def reset_game():
 #     pass
@@ -51,6 +52,15 @@ import select
 #     pass
 
 
+DEFAULT_ROOM = 0
+DEFAULT_MAX_ROOMS = 4096
+END_GAME_REPEATS = 10
+END_GAME_INTERVAL = 1
+SELECT_TIMEOUT = 0.1
+HEARTBEAT_INTERVAL = 1
+SLOW_HANDLER_MS = 50
+
+
 class ClientRole(IntEnum):
     WATCHER = 0
     CMAN = 1
@@ -58,11 +68,33 @@ class ClientRole(IntEnum):
 
 
 class GameServer:
-    def __init__(self, port=1337):
+    # A GameServer is one room, keep it small when a process hosts thousands
+    __slots__ = (
+        "port",
+        "socket_udp",
+        "game",
+        "clients",
+        "role_assignments",
+        "game_active",
+        "last_game_end",
+        "game_ending",
+        "end_messages_left",
+        "next_end_message",
+        "waiting_joins",
+        "outbox",
+        "send_queue",
+    )
+
+    def __init__(self, port=1337, sock=None, map_path="map.txt", send_queue=None):
         self.port = port
-        self.socket_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket_udp.bind(("127.0.0.1", port))
-        map_path = "map.txt"
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", port))
+        self.socket_udp = sock
+        # Rooms sharing a socket share its send queue too
+        if send_queue is None:
+            send_queue = cman_sendqueue.SendQueue(sock)
+        self.send_queue = send_queue
 
         self.game = game.Game(map_path)
 
@@ -72,6 +104,18 @@ class GameServer:
         self.game_active = False
         self.last_game_end = 0
 
+        # The end of a game is announced END_GAME_REPEATS times from tick(),
+        # so a finished room never blocks other rooms sharing the process.
+        self.game_ending = False
+        self.end_messages_left = 0
+        self.next_end_message = 0
+        # Players asking to join while the game is ending get the roles of the next game
+        self.waiting_joins = {}  # {address: role}
+
+        # Messages are queued per recipient while a message or tick is handled
+        # and sent by flush(), several of them sharing a datagram as a bundle.
+        self.outbox = {}  # {address: [data]}
+
     def start_new_game(self):
         self.game.restart_game()
         self.role_assignments = {ClientRole.CMAN: None, ClientRole.SPIRIT: None}
@@ -81,18 +125,40 @@ class GameServer:
             if role == ClientRole.WATCHER
         }
         self.broadcast_state()
+        # In their order of arrival, a role asked for twice goes to the first one
+        waiting_joins, self.waiting_joins = self.waiting_joins, {}
+        for client_addr, role in waiting_joins.items():
+            self.handle_join_request(client_addr, role)
 
     def handle_game_end(self):
         self.game_active = False
         self.last_game_end = time.time()
 
-        for _ in range(10):
-            data = self.build_end_game_message()
-            for client_addr in self.clients.keys():
-                self.send_message(client_addr, data)
-            time.sleep(1)
+        self.game_ending = True
+        self.end_messages_left = END_GAME_REPEATS
+        self.next_end_message = self.last_game_end
+        self.tick(self.last_game_end)
+
+    def tick(self, now):
+        if not self.game_ending or now < self.next_end_message:
+            return
 
-        self.start_new_game()
+        if self.end_messages_left == 0:
+            self.game_ending = False
+            self.start_new_game()
+            return
+
+        data = self.build_end_game_message()
+        for client_addr in self.clients.keys():
+            self.send_message(client_addr, data)
+        self.end_messages_left -= 1
+        self.next_end_message = now + END_GAME_INTERVAL
+
+        if self.end_messages_left == 0 and now > self.last_game_end:
+            # The watchers get the last end message and the new game's state in one bundle.
+            # Never within handle_game_end() itself, the room must be seen ending first.
+            self.game_ending = False
+            self.start_new_game()
 
     def broadcast_state(self):
         for client_addr in self.clients.keys():
@@ -101,7 +167,10 @@ class GameServer:
             self.send_message(client_addr, data)
 
     def handle_disconnect(self, client_addr):
+        waiting = self.waiting_joins.pop(client_addr, None) is not None
         if client_addr not in self.clients:
+            if waiting:
+                return
             data = self.build_disconnect_response(
                 "Client is not player", message_util.OPCODE_ERROR
             )
@@ -122,6 +191,7 @@ class GameServer:
         return
 
     def handle_broken_socket(self, client_addr):
+        self.waiting_joins.pop(client_addr, None)
         if client_addr not in self.clients:
             return
 
@@ -169,7 +239,7 @@ class GameServer:
             game.Player.CMAN if client_role == ClientRole.CMAN else game.Player.SPIRIT
         )
 
-        if direction not in game.Direction:
+        if direction not in list(game.Direction):
             data = self.build_move_response(
                 "Invalid direction", message_util.OPCODE_ERROR, client_role
             )
@@ -203,6 +273,14 @@ class GameServer:
         requested_role = ClientRole(role)
 
         if requested_role in [ClientRole.CMAN, ClientRole.SPIRIT]:
+            if self.game_ending:
+                # Answered by start_new_game(), once the roles are free again
+                self.waiting_joins[client_addr] = requested_role
+                return
+            if self.role_assignments[requested_role] == client_addr:
+                # A retried join whose answer was lost, the client already holds the role
+                self.send_message(client_addr, self.build_update_state_message(role))
+                return
             if self.game_active:
                 message = "Game has already started"
                 message_type = message_util.OPCODE_ERROR
@@ -252,10 +330,7 @@ class GameServer:
         coords_s = self.game.get_current_players_coords()[1]
         attempts = 3 - self.game.lives
 
-        collected = [str(1 - item) for item in self.game.get_points().values()]
-        binary_string = "".join(collected)
-        integer_representation = int(binary_string, 2)
-        collected_binary = integer_representation.to_bytes(5, byteorder="big")
+        collected_binary = self.game.get_collected().to_bytes(5, byteorder="big")
 
         return message_util.create_game_state_update_message(
             freeze, coords_c, coords_s, attempts, collected_binary
@@ -270,23 +345,44 @@ class GameServer:
         return data
 
     def send_message(self, client_address, data):
-        self.socket_udp.sendto(data, client_address)
+        messages = self.outbox.get(client_address)
+        if messages is None:
+            self.outbox[client_address] = [data]
+        else:
+            messages.append(data)
+
+    def flush(self):
+        if not self.outbox:
+            return
+        outbox = self.outbox
+        self.outbox = {}
+        for client_address, messages in outbox.items():
+            for data in message_util.create_bundle_messages(messages):
+                # A newer plain state update makes a queued one useless
+                replaceable = data[0] == message_util.OPCODE_GAME_STATE_UPDATE
+                self.send_queue.send(data, client_address, replaceable)
+
+    def handle_message(self, client_addr, message):
+        if message[0] == message_util.OPCODE_JOIN_REQUEST:
+            self.handle_join_request(client_addr, message[1])
+        elif message[0] == message_util.OPCODE_PLAYER_MOVEMENT:
+            self.handle_move(client_addr, message[1])
+        elif message[0] == message_util.OPCODE_QUIT:
+            self.handle_disconnect(client_addr)
 
     def run(self):
         while True:
-            readable, _, _ = select.select([self.socket_udp], [], [], 0.1)
+            writers = [self.socket_udp] if self.send_queue.pending() else []
+            readable, writable, _ = select.select([self.socket_udp], writers, [], SELECT_TIMEOUT)
+
+            if writable:
+                self.send_queue.flush()
 
             if readable:
                 try:
                     data, addr = self.socket_udp.recvfrom(1024)
-                    message = message_util.decode_message(data)
-
-                    if message[0] == message_util.OPCODE_JOIN_REQUEST:
-                        self.handle_join_request(addr, message[1])
-                    elif message[0] == message_util.OPCODE_PLAYER_MOVEMENT:
-                        self.handle_move(addr, message[1])
-                    elif message[0] == message_util.OPCODE_QUIT:
-                        self.handle_disconnect(addr)
+                    self.handle_message(addr, message_util.decode_message(data))
+                    self.flush()
                 except socket.error:
                     pass
                 except TypeError:
@@ -294,7 +390,175 @@ class GameServer:
                 except Exception as e:
                     print(f"Error: {e}")
 
-            time.sleep(0.1)
+            self.tick(time.time())
+            self.flush()
+
+
+class RoomServer:
+    """Hosts many independent GameServer rooms behind a single UDP socket.
+
+    Clients pick a room in their join request (room 0 when omitted) and all of
+    their later datagrams are routed to that room by source address.
+    """
+
+    def __init__(
+        self,
+        port=1337,
+        sock=None,
+        max_rooms=DEFAULT_MAX_ROOMS,
+        map_path="map.txt",
+        lobby_addr=None,
+        slow_handler_ms=SLOW_HANDLER_MS,
+        sndbuf=None,
+        rcvbuf=None,
+    ):
+        self.port = port
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", port))
+        self.socket_udp = sock
+        cman_sendqueue.set_buffer_sizes(sock, sndbuf, rcvbuf)
+        self.send_queue = cman_sendqueue.SendQueue(sock)
+        self.next_send_report = 0
+        self.running = True
+        self.max_rooms = max_rooms
+        self.map_path = map_path
+        game.load_map(map_path)  # load once up front, rooms only share the loaded map
+
+        self.rooms = {}  # {room_id: GameServer}
+        self.client_rooms = {}  # {address: room_id}
+        self.ending_rooms = set()
+
+        self.lobby_addr = lobby_addr
+        self.next_heartbeat = 0
+
+        # Handlers slower than this are logged to tell a slow server loop from a slow network
+        self.slow_handler = slow_handler_ms / 1000
+
+    def get_room(self, room_id, create=False):
+        room = self.rooms.get(room_id)
+        if room is None and create and len(self.rooms) < self.max_rooms:
+            room = GameServer(self.port, self.socket_udp, self.map_path, self.send_queue)
+            self.rooms[room_id] = room
+        return room
+
+    def send_error(self, client_addr, message):
+        self.send_queue.send(message_util.create_error_message(message), client_addr)
+
+    def handle_datagram(self, data, client_addr, received=None):
+        message = message_util.decode_message(data)
+        if message[0] == message_util.OPCODE_PING:
+            self.handle_ping(client_addr, message, received)
+            return
+        current_room_id = self.client_rooms.get(client_addr)
+
+        if message[0] == message_util.OPCODE_JOIN_REQUEST:
+            room_id = DEFAULT_ROOM if message[2] is None else message[2]
+            if current_room_id is not None and current_room_id != room_id:
+                self.leave_room(client_addr, current_room_id)
+            room = self.get_room(room_id, create=True)
+            if room is None:
+                self.forget_client(client_addr)
+                self.send_error(client_addr, "Room is not available")
+                return
+        else:
+            room_id = current_room_id
+            room = None if room_id is None else self.rooms.get(room_id)
+            if room is None:
+                self.send_error(client_addr, "Client is not a player")
+                return
+
+        room.handle_message(client_addr, message)
+        room.flush()
+        self.track_client(client_addr, room_id, room)
+
+    def handle_ping(self, client_addr, message, received=None):
+        if received is None:
+            received = time.perf_counter()
+        _, seq, client_time = message
+        data = message_util.create_pong_message(seq, client_time, received, time.perf_counter())
+        self.send_queue.send(data, client_addr)
+
+    def leave_room(self, client_addr, room_id):
+        room = self.rooms.get(room_id)
+        if room is not None and client_addr in room.clients:
+            room.handle_message(client_addr, (message_util.OPCODE_QUIT, None))
+            room.flush()
+            self.track_client(client_addr, room_id, room)
+        self.forget_client(client_addr)
+
+    def forget_client(self, client_addr):
+        self.client_rooms.pop(client_addr, None)
+
+    def track_client(self, client_addr, room_id, room):
+        if client_addr in room.clients or client_addr in room.waiting_joins:
+            self.client_rooms[client_addr] = room_id
+        else:
+            self.forget_client(client_addr)
+        if room.game_ending:
+            self.ending_rooms.add(room_id)
+        elif not room.clients:
+            del self.rooms[room_id]
+
+    def tick(self, now):
+        for room_id in list(self.ending_rooms):
+            room = self.rooms[room_id]
+            players = [addr for addr in room.role_assignments.values() if addr] + list(room.waiting_joins)
+            room.tick(now)
+            room.flush()
+            if room.game_ending:
+                continue
+
+            # start_new_game() dropped the players and refused some waiting joins, forget where they were
+            self.ending_rooms.discard(room_id)
+            for addr in players:
+                if addr not in room.clients and self.client_rooms.get(addr) == room_id:
+                    self.forget_client(addr)
+            if not room.clients:
+                del self.rooms[room_id]
+
+        if self.lobby_addr is not None and now >= self.next_heartbeat:
+            self.send_heartbeat()
+            self.next_heartbeat = now + HEARTBEAT_INTERVAL
+
+        if now >= self.next_send_report:
+            if self.send_queue.changed():
+                print(f"Send queue: {self.send_queue.format()}")
+            self.next_send_report = now + cman_sendqueue.SEND_STATS_INTERVAL
+
+    def send_heartbeat(self):
+        data = message_util.create_heartbeat_message(
+            self.port, len(self.rooms), self.max_rooms, len(self.client_rooms)
+        )
+        self.send_queue.send(data, self.lobby_addr, replaceable=True)
+
+    def recv_datagram(self):
+        return self.socket_udp.recvfrom(1024)
+
+    def run(self):
+        while self.running:
+            writers = [self.socket_udp] if self.send_queue.pending() else []
+            readable, writable, _ = select.select([self.socket_udp], writers, [], SELECT_TIMEOUT)
+
+            if writable:
+                self.send_queue.flush()
+
+            if readable:
+                try:
+                    data, addr = self.recv_datagram()
+                    received = time.perf_counter()
+                    self.handle_datagram(data, addr, received)
+                    elapsed = time.perf_counter() - received
+                    if elapsed > self.slow_handler:
+                        print(f"Slow handler: opcode {data[0]:#04x} from {addr} took {elapsed * 1000:.1f}ms")
+                except socket.error:
+                    pass
+                except TypeError:
+                    pass
+                except Exception as e:
+                    print(f"Error: {e}")
+
+            self.tick(time.time())
 
 
 def main():
@@ -306,13 +570,102 @@ def main():
         default=1337,
         help="Port number to use (default: 1337)",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes hosting rooms (default: 1)",
+    )
+    parser.add_argument(
+        "--max-rooms",
+        type=int,
+        default=DEFAULT_MAX_ROOMS,
+        help=f"Maximum number of rooms per worker (default: {DEFAULT_MAX_ROOMS})",
+    )
+    parser.add_argument(
+        "-l",
+        "--lobby",
+        type=str,
+        default=None,
+        help="Lobby address (host:port) to report load to",
+    )
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        type=str,
+        default=None,
+        help="Snapshot file to restore the rooms from on start and to save them to on exit",
+    )
+    parser.add_argument(
+        "--slow-ms",
+        type=float,
+        default=SLOW_HANDLER_MS,
+        help=f"Log handlers slower than this many milliseconds (default: {SLOW_HANDLER_MS})",
+    )
+    parser.add_argument(
+        "-m",
+        "--map",
+        type=str,
+        default="map.txt",
+        help="Map file, or map pack as pack.cmpk[:name] (default: map.txt)",
+    )
+    parser.add_argument(
+        "--sndbuf",
+        type=int,
+        default=None,
+        help="Socket send buffer size in bytes (default: the system's)",
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        type=int,
+        default=None,
+        help="Socket receive buffer size in bytes (default: the system's)",
+    )
     args = parser.parse_args()
 
+    lobby_addr = None
+    if args.lobby:
+        lobby_host, lobby_port = args.lobby.rsplit(":", 1)
+        lobby_addr = (lobby_host, int(lobby_port))
+
     host = "127.0.0.1"
     port = args.port
 
-    server = GameServer(args.port)
-    server.run()
+    if args.workers > 1:
+        import cman_workers
+
+        server = cman_workers.Dispatcher(
+            args.port,
+            args.workers,
+            args.max_rooms,
+            args.map,
+            lobby_addr=lobby_addr,
+            snapshot_path=args.snapshot,
+            slow_handler_ms=args.slow_ms,
+            sndbuf=args.sndbuf,
+            rcvbuf=args.rcvbuf,
+        )
+        server.run()
+        return
+
+    server = RoomServer(
+        args.port,
+        max_rooms=args.max_rooms,
+        map_path=args.map,
+        lobby_addr=lobby_addr,
+        slow_handler_ms=args.slow_ms,
+        sndbuf=args.sndbuf,
+        rcvbuf=args.rcvbuf,
+    )
+    if args.snapshot:
+        import cman_snapshot
+
+        cman_snapshot.check_shards(args.snapshot)
+        cman_snapshot.restore_snapshot(server, args.snapshot)
+        cman_snapshot.run_with_snapshot(server, args.snapshot)
+    else:
+        server.run()
 
 
 if __name__ == "__main__":
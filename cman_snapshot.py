@@ -0,0 +1,239 @@
+import os
+import signal
+import socket
+import struct
+import time
+
+import cman_game as game
+import cman_game_map as gm
+from cman_server import ClientRole
+
+MAGIC = b"CMSS"
+VERSION = 3
+
+# magic, version, worker count, worker index, map digest, room count
+HEADER = struct.Struct("!4sBHH32sI")
+# room id, game_active, game_ending, end messages left, seconds to next end message,
+# last game end, state, winner, lives, score, collected, cman coords, spirit coords,
+# cman address, spirit address, client count
+ROOM = struct.Struct("!HBBBfdBbBBQBBBB4sH4sHH")
+# address, role
+CLIENT = struct.Struct("!4sHB")
+
+NO_ADDRESS = (b"\0\0\0\0", 0)
+
+# Plain lookups, calling the enum classes is the slowest part of a restore
+ROLES = tuple(ClientRole)
+STATES = tuple(game.State)
+PLAYERS = {player.value: player for player in game.Player}
+
+
+def pack_address(addr):
+    if addr is None:
+        return NO_ADDRESS
+    return socket.inet_aton(addr[0]), addr[1]
+
+
+def unpack_address(ip, port):
+    if port == 0:
+        return None
+    return socket.inet_ntoa(ip), port
+
+
+def shard_path(path, workers=1, index=0):
+    """The snapshot file of a worker, a single process server uses path itself."""
+    return path if workers == 1 else f"{path}.{index}"
+
+
+def check_shards(path, workers=1):
+    """Raises ValueError if snapshot files saved with another worker count are next to path.
+
+    Rooms are spread over the workers by room_id % workers, restoring them
+    with another count would put rooms on workers that never get their joins.
+    """
+    directory, name = os.path.split(path)
+    for entry in os.listdir(directory or "."):
+        suffix = entry[len(name):]
+        if not entry.startswith(name) or not (suffix == "" or suffix[:1] == "." and suffix[1:].isdigit()):
+            continue
+        entry_path = os.path.join(directory, entry)
+        with open(entry_path, "rb") as f:
+            header = f.read(HEADER.size)
+        # A file name that fits this worker count may still come from a larger one
+        saved_workers = HEADER.unpack(header)[2] if len(header) == HEADER.size else None
+        if entry != os.path.basename(shard_path(path, workers, int(suffix[1:] or 0))) or saved_workers != workers:
+            raise ValueError(
+                f"Snapshot {entry_path} was saved with another worker count, restart with the same -w or remove it"
+            )
+
+
+def dump_rooms(server, now=None, workers=1, index=0):
+    """Serializes every room of a RoomServer into a compact binary blob."""
+    if now is None:
+        now = time.time()
+    digest = gm.load_layout(server.map_path).digest
+
+    ips = {}  # most clients share a handful of hosts, convert each one once
+    parts = [HEADER.pack(MAGIC, VERSION, workers, index, digest, len(server.rooms))]
+    for room_id, room in server.rooms.items():
+        state = room.game
+        (c_row, c_col), (s_row, s_col) = state.cur_coords
+        parts.append(
+            ROOM.pack(
+                room_id,
+                room.game_active,
+                room.game_ending,
+                room.end_messages_left,
+                max(0.0, room.next_end_message - now),
+                room.last_game_end,
+                state.state,
+                -1 if state.winner is None else state.winner,
+                state.lives,
+                state.score,
+                state.collected,
+                c_row,
+                c_col,
+                s_row,
+                s_col,
+                *pack_address(room.role_assignments[ClientRole.CMAN]),
+                *pack_address(room.role_assignments[ClientRole.SPIRIT]),
+                len(room.clients),
+            )
+        )
+        for (host, port), role in room.clients.items():
+            ip = ips.get(host)
+            if ip is None:
+                ip = ips[host] = socket.inet_aton(host)
+            parts.append(CLIENT.pack(ip, port, role))
+    return b"".join(parts)
+
+
+def load_rooms(server, data, now=None, workers=1, index=0):
+    """Recreates the rooms serialized by dump_rooms() inside a RoomServer.
+
+    Returns the number of restored rooms.
+    """
+    if now is None:
+        now = time.time()
+
+    magic, version, saved_workers, saved_index, digest, room_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a snapshot file or unsupported snapshot version")
+    if (saved_workers, saved_index) != (workers, index):
+        raise ValueError(
+            f"Snapshot was taken by worker {saved_index} of {saved_workers}, not worker {index} of {workers}"
+        )
+    # Same dimensions are not enough, coordinates and collected bits only make sense on the same map
+    if digest != gm.load_layout(server.map_path).digest:
+        raise ValueError("Snapshot was taken on a different map")
+
+    hosts = {}
+    offset = HEADER.size
+    for _ in range(room_count):
+        (
+            room_id,
+            game_active,
+            game_ending,
+            end_messages_left,
+            end_delay,
+            last_game_end,
+            state,
+            winner,
+            lives,
+            score,
+            collected,
+            c_row,
+            c_col,
+            s_row,
+            s_col,
+            cman_ip,
+            cman_port,
+            spirit_ip,
+            spirit_port,
+            client_count,
+        ) = ROOM.unpack_from(data, offset)
+        offset += ROOM.size
+
+        room = server.get_room(room_id, create=True)
+        if room is None:
+            raise ValueError("Snapshot holds more rooms than the server allows")
+
+        room.game_active = bool(game_active)
+        room.game_ending = bool(game_ending)
+        room.end_messages_left = end_messages_left
+        room.next_end_message = now + end_delay
+        room.last_game_end = last_game_end
+        room.role_assignments = {
+            ClientRole.CMAN: unpack_address(cman_ip, cman_port),
+            ClientRole.SPIRIT: unpack_address(spirit_ip, spirit_port),
+        }
+
+        room.game.state = STATES[state]
+        room.game.winner = None if winner < 0 else PLAYERS[winner]
+        room.game.lives = lives
+        room.game.score = score
+        room.game.collected = collected
+        room.game.cur_coords = [(c_row, c_col), (s_row, s_col)]
+
+        clients = {}
+        for _ in range(client_count):
+            ip, port, role = CLIENT.unpack_from(data, offset)
+            offset += CLIENT.size
+            host = hosts.get(ip)
+            if host is None:
+                host = hosts[ip] = socket.inet_ntoa(ip)
+            addr = (host, port)
+            clients[addr] = ROLES[role]
+            server.client_rooms[addr] = room_id
+        room.clients = clients
+
+        if room.game_ending:
+            server.ending_rooms.add(room_id)
+
+    return room_count
+
+
+def save_snapshot(server, path, workers=1, index=0):
+    """Writes a snapshot of all rooms to path, returns its size in bytes."""
+    data = dump_rooms(server, workers=workers, index=index)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def load_snapshot(server, path, workers=1, index=0):
+    """Restores the rooms saved by save_snapshot(), returns the number of rooms."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return load_rooms(server, data, workers=workers, index=index)
+
+
+def restore_snapshot(server, path, workers=1, index=0):
+    """Restores path into server if it exists, then removes it so it is never replayed twice."""
+    if not os.path.exists(path):
+        return 0
+    started = time.perf_counter()
+    count = load_snapshot(server, path, workers, index)
+    os.remove(path)
+    print(f"Restored {count} rooms from {path} in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return count
+
+
+def run_with_snapshot(server, path, workers=1, index=0):
+    """Runs a RoomServer that saves its rooms to path when it is stopped by SIGTERM or Ctrl-C."""
+
+    def stop(signum, frame):
+        server.running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # A second signal must not cut the save short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        save_snapshot(server, path, workers, index)
@@ -0,0 +1,243 @@
+import multiprocessing
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+
+import cman_sendqueue
+import cman_server
+import cman_snapshot
+import message_util
+
+# Datagrams forwarded to a worker are prefixed with the original client address
+ADDRESS_HEADER = struct.Struct("!4sH")
+# Workers report the clients they no longer hold: address and time.monotonic() of the departure
+DEPARTURE = struct.Struct("!4sHd")
+DEPARTURES_PER_REPORT = 64  # keeps a report below the dispatcher's 1024-byte reads
+WORKER_STOP_TIMEOUT = 5  # seconds a stopping worker gets to save its snapshot before it is killed
+
+
+def wrap_datagram(client_addr, data):
+    return ADDRESS_HEADER.pack(socket.inet_aton(client_addr[0]), client_addr[1]) + data
+
+
+def unwrap_datagram(data):
+    ip, port = ADDRESS_HEADER.unpack_from(data)
+    return (socket.inet_ntoa(ip), port), data[ADDRESS_HEADER.size:]
+
+
+class WorkerRoomServer(cman_server.RoomServer):
+    """RoomServer fed by the Dispatcher instead of directly by the clients.
+
+    Replies are still sent straight to the client address from the worker's
+    own socket, so the dispatcher only ever handles the inbound direction.
+    Clients that left every room are reported back to the dispatcher, which
+    then drops their routes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The dispatcher listens on the port the worker reports to the lobby
+        self.dispatcher_addr = ("127.0.0.1", self.port)
+        self.departed = {}  # {address: departure time}
+
+    def forget_client(self, client_addr):
+        super().forget_client(client_addr)
+        self.departed[client_addr] = time.monotonic()
+
+    def tick(self, now):
+        super().tick(now)
+        if not self.departed:
+            return
+        # A client that re-joined a room here since is not gone
+        departed = [
+            DEPARTURE.pack(socket.inet_aton(addr[0]), addr[1], departed_at)
+            for addr, departed_at in self.departed.items()
+            if addr not in self.client_rooms
+        ]
+        self.departed = {}
+        for start in range(0, len(departed), DEPARTURES_PER_REPORT):
+            self.send_queue.send(b"".join(departed[start:start + DEPARTURES_PER_REPORT]), self.dispatcher_addr)
+
+    def recv_datagram(self):
+        data, _ = self.socket_udp.recvfrom(1024 + ADDRESS_HEADER.size)
+        client_addr, data = unwrap_datagram(data)
+        return data, client_addr
+
+
+def run_worker(port, max_rooms, map_path, lobby_addr, snapshot_path, shard, slow_handler_ms, sndbuf, rcvbuf, conn):
+    # Ctrl-C reaches the whole process group, workers only stop when the dispatcher stops them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    # Workers report to the lobby on their own, under the dispatcher's port
+    server = WorkerRoomServer(port, sock, max_rooms, map_path, lobby_addr, slow_handler_ms, sndbuf, rcvbuf)
+    if snapshot_path:
+        cman_snapshot.restore_snapshot(server, snapshot_path, *shard)
+
+    # The dispatcher needs the restored clients to route them back here
+    conn.send((sock.getsockname(), list(server.client_rooms)))
+    conn.close()
+    if snapshot_path:
+        cman_snapshot.run_with_snapshot(server, snapshot_path, *shard)
+        return
+    server.run()
+
+
+class Dispatcher:
+    """Front socket of the multi-process server.
+
+    Every room lives on exactly one worker (room_id % workers), and every
+    datagram of a client is forwarded to the worker of the room it joined.
+
+    Workers spread the game logic over cores, but every inbound datagram
+    still costs the dispatcher a recvfrom, an address header and a sendto in
+    one Python loop. Total inbound throughput is capped by that single core
+    however many workers run, `cman_bench.py throughput` measures it.
+    """
+
+    def __init__(
+        self,
+        port=1337,
+        workers=2,
+        max_rooms=cman_server.DEFAULT_MAX_ROOMS,
+        map_path="map.txt",
+        lobby_addr=None,
+        snapshot_path=None,
+        slow_handler_ms=cman_server.SLOW_HANDLER_MS,
+        sndbuf=None,
+        rcvbuf=None,
+    ):
+        self.port = port
+        self.socket_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_udp.bind(("127.0.0.1", port))
+        cman_sendqueue.set_buffer_sizes(self.socket_udp, sndbuf, rcvbuf)
+        self.send_queue = cman_sendqueue.SendQueue(self.socket_udp)
+
+        self.processes = []
+        self.worker_addrs = []
+        self.routes = {}  # {address: worker index}
+        self.forwarded = {}  # {address: time.monotonic() of its last forwarded datagram}
+        self.worker_indexes = {}  # {worker address: worker index}
+        if snapshot_path:
+            cman_snapshot.check_shards(snapshot_path, workers)
+        for index in range(workers):
+            # Each worker keeps its own snapshot file, the room layout is per worker
+            worker_snapshot = cman_snapshot.shard_path(snapshot_path, workers, index) if snapshot_path else None
+            parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    port,
+                    max_rooms,
+                    map_path,
+                    lobby_addr,
+                    worker_snapshot,
+                    (workers, index),
+                    slow_handler_ms,
+                    sndbuf,
+                    rcvbuf,
+                    child_conn,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            worker_addr, restored_clients = parent_conn.recv()
+            parent_conn.close()
+            self.worker_indexes[worker_addr] = len(self.worker_addrs)
+            self.worker_addrs.append(worker_addr)
+            self.processes.append(process)
+            for client_addr in restored_clients:
+                self.routes[client_addr] = index
+
+    def worker_for_room(self, room_id):
+        return room_id % len(self.worker_addrs)
+
+    def route(self, client_addr, data):
+        opcode = data[0]
+        if opcode == message_util.OPCODE_JOIN_REQUEST:
+            room_id = cman_server.DEFAULT_ROOM
+            if len(data) == 4:
+                room_id = struct.unpack_from("!H", data, 2)[0]
+            worker = self.worker_for_room(room_id)
+            previous = self.routes.get(client_addr)
+            if previous is not None and previous != worker:
+                # RoomServer.leave_room() cannot see the other worker's rooms, quit the old room for the client
+                quit_message = message_util.create_quit_message()
+                self.send_queue.send(wrap_datagram(client_addr, quit_message), self.worker_addrs[previous])
+            self.routes[client_addr] = worker
+            return worker
+
+        worker = self.routes.get(client_addr)
+        if worker is None:
+            # Unknown client, any worker will answer with the proper error
+            worker = hash(client_addr) % len(self.worker_addrs)
+        elif opcode == message_util.OPCODE_QUIT:
+            del self.routes[client_addr]
+            self.forwarded.pop(client_addr, None)
+        return worker
+
+    def forward(self, data, client_addr):
+        worker = self.route(client_addr, data)
+        if client_addr in self.routes:
+            self.forwarded[client_addr] = time.monotonic()
+        self.send_queue.send(wrap_datagram(client_addr, data), self.worker_addrs[worker])
+
+    def handle_departures(self, worker, data):
+        for offset in range(0, len(data) - DEPARTURE.size + 1, DEPARTURE.size):
+            ip, port, departed_at = DEPARTURE.unpack_from(data, offset)
+            client_addr = (socket.inet_ntoa(ip), port)
+            # Keep the route if the client moved to another worker or sent anything after it left
+            if self.routes.get(client_addr) == worker and self.forwarded.get(client_addr, 0) <= departed_at:
+                del self.routes[client_addr]
+                self.forwarded.pop(client_addr, None)
+
+    def close(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        # SIGTERM asks a worker to stop, one running with a snapshot saves it first
+        for process in self.processes:
+            process.terminate()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+        for process in self.processes:
+            if process.is_alive():
+                print(f"Worker {process.pid} did not stop in {WORKER_STOP_TIMEOUT}s, killing it")
+                process.kill()
+                process.join()
+        self.socket_udp.close()
+
+    def run(self):
+        # Make a plain kill of the dispatcher take the workers down with it
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                writers = [self.socket_udp] if self.send_queue.pending() else []
+                readable, writable, _ = select.select(
+                    [self.socket_udp], writers, [], cman_server.SELECT_TIMEOUT
+                )
+
+                if writable:
+                    self.send_queue.flush()
+
+                if readable:
+                    try:
+                        data, addr = self.socket_udp.recvfrom(1024)
+                        worker = self.worker_indexes.get(addr)
+                        if worker is not None:
+                            self.handle_departures(worker, data)
+                        elif data:
+                            self.forward(data, addr)
+                    except socket.error:
+                        pass
+                    except Exception as e:
+                        print(f"Error: {e}")
+
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError("worker process exited")
+        finally:
+            self.close()
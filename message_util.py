@@ -1,19 +1,37 @@
+import socket
 import struct
 
 OPCODE_JOIN_REQUEST = 0x00  # Client->Server
 OPCODE_PLAYER_MOVEMENT = 0x01  # Client->Server
+OPCODE_PING = 0x02  # Client->Server
 OPCODE_QUIT = 0x0F  # Client->Server
+OPCODE_HEARTBEAT = 0x20  # Server->Lobby
 OPCODE_GAME_STATE_UPDATE = 0x80  # Server->Client
+OPCODE_REDIRECT = 0x81  # Lobby->Client
+OPCODE_PONG = 0x82  # Server->Client
+OPCODE_BUNDLE = 0x83  # Server->Client
 OPCODE_GAME_END = 0x8F  # Server->Client
 OPCODE_ERROR = 0xFF  # Server->Client
 
+MAX_BUNDLE_SIZE = 1200  # stays below the path MTU, so a bundle is never fragmented
+BUNDLE_ITEM_HEADER = struct.Struct('!H')
 
-def create_join_message(role):
-    return struct.pack('!BB', OPCODE_JOIN_REQUEST, role)
+
+def create_join_message(role, room=None):
+    # The room id is optional so that plain 2-byte joins keep landing in room 0
+    if room is None:
+        return struct.pack('!BB', OPCODE_JOIN_REQUEST, role)
+    return struct.pack('!BBH', OPCODE_JOIN_REQUEST, role, room)
 
 def create_player_movement_message(direction):
     return struct.pack('!BB', OPCODE_PLAYER_MOVEMENT, direction)
 
+def create_ping_message(seq, client_time):
+    return struct.pack('!BId', OPCODE_PING, seq, client_time)
+
+def create_pong_message(seq, client_time, server_recv_time, server_send_time):
+    return struct.pack('!BIddd', OPCODE_PONG, seq, client_time, server_recv_time, server_send_time)
+
 def create_quit_message():
     return struct.pack('!B', OPCODE_QUIT)
 
@@ -23,10 +41,44 @@ def create_game_state_update_message(freeze, coords_c, coords_s, attempts, colle
 def create_game_end_message(winner, score_s, score_c):
     return struct.pack('!BBBB', OPCODE_GAME_END, winner, score_s, score_c)
 
+def create_heartbeat_message(port, rooms, max_rooms, clients):
+    # Counts are 32 bits, a busy node easily holds more than 65535 clients
+    return struct.pack('!BHIII', OPCODE_HEARTBEAT, port, rooms, max_rooms, clients)
+
+def create_redirect_message(host, port, room):
+    return struct.pack('!B4sHH', OPCODE_REDIRECT, socket.inet_aton(host), port, room)
+
 def create_error_message(error_data):
     error_data_bytes = error_data.encode('utf-8')
     return struct.pack(f'!B{len(error_data_bytes)}s', OPCODE_ERROR, error_data_bytes)
 
+def create_bundle_messages(messages):
+    # Several messages to the same recipient share datagrams, each prefixed by its length.
+    # A lone message is sent as is, so clients that know nothing of bundles still get it.
+    if len(messages) == 1:
+        return list(messages)
+
+    datagrams = []
+    bundle = bytearray()
+    for data in messages:
+        item_size = BUNDLE_ITEM_HEADER.size + len(data)
+        if bundle and len(bundle) + item_size > MAX_BUNDLE_SIZE:
+            datagrams.append(bytes(bundle))
+            bundle = bytearray()
+        if not bundle:
+            bundle.append(OPCODE_BUNDLE)
+        bundle += BUNDLE_ITEM_HEADER.pack(len(data))
+        bundle += data
+    datagrams.append(bytes(bundle))
+    return datagrams
+
+def decode_messages(data):
+    # A received datagram holds either one message or a bundle of them
+    message = decode_message(data)
+    if message[0] == OPCODE_BUNDLE:
+        return message[1]
+    return [message]
+
 
 def decode_message(data):
     # Get the first byte (opcode) from the data
@@ -38,19 +90,33 @@ def decode_message(data):
         return decode_player_movement_message(data)
     elif opcode == OPCODE_QUIT:
         return decode_quit_message(data)
+    elif opcode == OPCODE_PING:
+        return decode_ping_message(data)
+    elif opcode == OPCODE_PONG:
+        return decode_pong_message(data)
     elif opcode == OPCODE_GAME_STATE_UPDATE:
         return decode_game_state_update_message(data)
     elif opcode == OPCODE_GAME_END:
         return decode_game_end_message(data)
+    elif opcode == OPCODE_HEARTBEAT:
+        return decode_heartbeat_message(data)
+    elif opcode == OPCODE_REDIRECT:
+        return decode_redirect_message(data)
     elif opcode == OPCODE_ERROR:
         return decode_error_message(data)
+    elif opcode == OPCODE_BUNDLE:
+        return decode_bundle_message(data)
     else:
         raise ValueError(f"Unknown opcode: {hex(opcode)}")
     
 def decode_join_message(data):
-    opcode, role = struct.unpack('!BB', data)
+    if len(data) == 4:
+        opcode, role, room = struct.unpack('!BBH', data)
+    else:
+        opcode, role = struct.unpack('!BB', data)
+        room = None
 
-    return OPCODE_JOIN_REQUEST, role
+    return OPCODE_JOIN_REQUEST, role, room
 
 def decode_player_movement_message(data):
     opcode, direction = struct.unpack('!BB', data)
@@ -62,6 +128,16 @@ def decode_quit_message(data):
 
     return OPCODE_QUIT, None
 
+def decode_ping_message(data):
+    opcode, seq, client_time = struct.unpack('!BId', data)
+
+    return OPCODE_PING, seq, client_time
+
+def decode_pong_message(data):
+    opcode, seq, client_time, server_recv_time, server_send_time = struct.unpack('!BIddd', data)
+
+    return OPCODE_PONG, seq, client_time, server_recv_time, server_send_time
+
 def decode_game_state_update_message(data):
     opcode, freeze, coords_c_x, coords_c_y, coords_s_x, coords_s_y, attempts = struct.unpack('!BBBBBBB', data[:7])
 
@@ -76,8 +152,31 @@ def decode_game_end_message(data):
 
     return OPCODE_GAME_END, winner, score_s, score_c
 
+def decode_heartbeat_message(data):
+    opcode, port, rooms, max_rooms, clients = struct.unpack('!BHIII', data)
+
+    return OPCODE_HEARTBEAT, port, rooms, max_rooms, clients
+
+def decode_redirect_message(data):
+    opcode, host, port, room = struct.unpack('!B4sHH', data)
+
+    return OPCODE_REDIRECT, socket.inet_ntoa(host), port, room
+
 def decode_error_message(data):
     opcode = struct.unpack('!B', data[:1])[0]
     error_data = data[1:]
 
     return OPCODE_ERROR, error_data
+
+def decode_bundle_message(data):
+    messages = []
+    offset = 1
+    while offset < len(data):
+        size = BUNDLE_ITEM_HEADER.unpack_from(data, offset)[0]
+        offset += BUNDLE_ITEM_HEADER.size
+        if size == 0 or offset + size > len(data):
+            raise ValueError("Truncated bundle")
+        messages.append(decode_message(data[offset:offset + size]))
+        offset += size
+
+    return OPCODE_BUNDLE, messages